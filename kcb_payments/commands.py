@@ -0,0 +1,170 @@
+import csv
+import itertools
+import json
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import click
+from frappe.commands import get_site, pass_context
+
+
+def _connect(site):
+	import frappe
+
+	frappe.init(site=site)
+	frappe.connect()
+	frappe.set_user("Administrator")
+
+
+def _ingest_chunk(lines, verify_signatures):
+	import frappe
+
+	from kcb_payments.kcb_payments.utils.replay import ingest_lines
+
+	try:
+		return ingest_lines(lines, verify_signatures=verify_signatures)
+	except Exception:
+		# the worker goes on to its next chunk, which must not commit this one's leftovers
+		frappe.db.rollback()
+		raise
+
+
+def read_chunks(path, chunk_size):
+	"""Yield lists of (line_number, line) without loading the whole file"""
+	with open(path, encoding="utf-8") as f:
+		numbered = ((number, line) for number, line in enumerate(f, start=1) if line.strip())
+		while chunk := list(itertools.islice(numbered, chunk_size)):
+			yield chunk
+
+
+@click.command("kcb-replay-ipn")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+	"--verify-signatures", is_flag=True, default=False, help="Reject lines without a valid signature"
+)
+@click.option("--chunk-size", type=int, default=500, help="Notifications per bulk insert")
+@click.option("--workers", type=int, default=4, help="Worker processes")
+@click.option(
+	"--rejects", type=click.Path(dir_okay=False), help="Write rejected line numbers and reasons here"
+)
+@pass_context
+def replay_ipn(context, path, verify_signatures=False, chunk_size=500, workers=4, rejects=None):
+	"""Ingest IPN payloads from a JSONL file, one raw notification body per line"""
+	site = get_site(context)
+
+	created = duplicate = total = 0
+	rejected = []
+	# (first line, last line, error) of chunks whose worker raised
+	failed = []
+	started = time.monotonic()
+
+	try:
+		with ProcessPoolExecutor(
+			max_workers=workers,
+			mp_context=multiprocessing.get_context("spawn"),
+			initializer=_connect,
+			initargs=(site,),
+		) as executor:
+			in_flight = {}
+			chunks = read_chunks(path, chunk_size)
+
+			while True:
+				# keep a bounded number of chunks queued so memory stays flat
+				while len(in_flight) < workers * 2 and (chunk := next(chunks, None)):
+					future = executor.submit(_ingest_chunk, chunk, verify_signatures)
+					in_flight[future] = (chunk[0][0], chunk[-1][0], len(chunk))
+
+				if not in_flight:
+					break
+
+				done, _pending = wait(in_flight, return_when=FIRST_COMPLETED)
+				for future in done:
+					first_line, last_line, count = in_flight.pop(future)
+					total += count
+					try:
+						result = future.result()
+					except Exception as e:
+						failed.append((first_line, last_line, f"{type(e).__name__}: {e!s}"))
+						continue
+
+					created += result.created
+					duplicate += result.duplicate
+					rejected.extend(result.rejected)
+
+				elapsed = time.monotonic() - started
+				click.echo(
+					f"\r{total} lines, {created} created, {duplicate} duplicate, {len(rejected)} rejected,"
+					f" {len(failed)} chunks failed ({total / elapsed:.0f} lines/s)",
+					nl=False,
+				)
+	finally:
+		print_replay_totals(total, created, duplicate, rejected, failed, time.monotonic() - started, rejects)
+
+	if failed:
+		raise SystemExit(1)
+
+
+def print_replay_totals(total, created, duplicate, rejected, failed, elapsed, rejects=None):
+	click.echo()
+	click.secho(
+		f"Replayed {total} notifications in {elapsed:.1f}s ({total / max(elapsed, 0.001):.0f}/s): "
+		f"{created} created, {duplicate} duplicate, {len(rejected)} rejected, {len(failed)} chunks failed",
+		fg="green" if not (rejected or failed) else "yellow",
+	)
+
+	for first_line, last_line, error in failed:
+		click.secho(f"  lines {first_line}-{last_line} not ingested: {error}", fg="red")
+
+	rejected.sort()
+	if rejects:
+		with open(rejects, "w", encoding="utf-8") as f:
+			for line_number, reason in rejected:
+				f.write(f"{line_number}\t{reason}\n")
+		click.echo(f"Rejected lines written to {rejects}")
+	else:
+		for line_number, reason in rejected[:50]:
+			click.echo(f"  line {line_number}: {reason}")
+		if len(rejected) > 50:
+			click.echo(f"  ... {len(rejected) - 50} more, use --rejects to write them all")
+
+
+def read_references(path):
+	"""Items from a JSON list, or a CSV with reference_doctype,reference_name[,phone_number,amount] columns"""
+	with open(path, encoding="utf-8") as f:
+		if path.endswith(".json"):
+			return json.load(f)
+		return [{key: value for key, value in row.items() if value} for row in csv.DictReader(f)]
+
+
+@click.command("kcb-bulk-stk-push")
+@click.argument("settings")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--concurrency", type=int, default=4, help="Pushes sent in parallel")
+@pass_context
+def send_bulk_stk_push(context, settings, path, concurrency=4):
+	"""Send STK pushes through SETTINGS (a KCB Mpesa Settings name) for the references in PATH"""
+	import frappe
+
+	from kcb_payments.kcb_payments.utils.bulk_stk import bulk_stk_push
+
+	items = read_references(path)
+
+	_connect(get_site(context))
+	try:
+		result = bulk_stk_push(settings, items, concurrency=concurrency)
+	finally:
+		frappe.destroy()
+
+	for row in result.results:
+		if row.status not in ("In Progress", "Completed"):
+			click.echo(f"  {row.reference_doctype} {row.reference_name}: {row.status} {row.error or ''}")
+
+	summary = ", ".join(f"{count} {status}" for status, count in sorted(result.summary.items()))
+	click.secho(
+		f"Sent {len(result.results)} requests in {result.elapsed:.1f}s ({result.throughput}/s): {summary}",
+		fg="green",
+	)
+
+
+commands = [replay_ipn, send_bulk_stk_push]
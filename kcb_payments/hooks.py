@@ -103,6 +103,11 @@ if "frappe_mpesa_payments" not in installed_apps:
 # before_uninstall = "kcb_payments.uninstall.before_uninstall"
 # after_uninstall = "kcb_payments.uninstall.after_uninstall"
 
+# Migration
+# ------------
+
+after_migrate = ["kcb_payments.kcb_payments.utils.token_cache.warm_tokens"]
+
 # Integration Setup
 # ------------------
 # To set up dependencies/integrations with other apps
@@ -178,6 +183,23 @@ if "frappe_mpesa_payments" not in installed_apps:
 # 	],
 # }
 
+scheduler_events = {
+	"cron": {
+		"* * * * *": [
+			"kcb_payments.kcb_payments.utils.ipn_inbox.process_ipn_inbox",
+			"kcb_payments.kcb_payments.utils.token_cache.refresh_expiring_tokens",
+			"kcb_payments.kcb_payments.utils.stk_sweeper.sweep_stk_requests",
+		],
+		"*/5 * * * *": [
+			"kcb_payments.kcb_payments.utils.diagnostics.flush_diagnostics",
+			"kcb_payments.kcb_payments.utils.stk_post_processing.process_pending_stk_requests",
+		],
+	},
+}
+
+# STK status query used by the sweeper, the last one listed wins
+kcb_stk_status_query = ["kcb_payments.kcb_payments.utils.stk_sweeper.expire_stale_requests"]
+
 # Testing
 # -------
 
@@ -210,11 +232,13 @@ if "frappe_mpesa_payments" not in installed_apps:
 # ----------------
 # before_request = ["kcb_payments.kcb_payments.utils.before_request.clean_kcb_auth"]
 # after_request = ["kcb_payments.utils.after_request"]
+after_request = ["kcb_payments.kcb_payments.utils.metrics.flush_if_due"]
 
 # Job Events
 # ----------
 # before_job = ["kcb_payments.utils.before_job"]
 # after_job = ["kcb_payments.utils.after_job"]
+after_job = ["kcb_payments.kcb_payments.utils.metrics.flush_if_due"]
 
 # User Data Protection
 # --------------------
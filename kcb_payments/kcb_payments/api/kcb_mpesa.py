@@ -6,8 +6,26 @@ import frappe
 import requests
 from frappe import _
 
+from ..utils import buni_client
+from ..utils.circuit_breaker import CircuitOpenError
+from ..utils.metrics import instrument, set_till, track
+from ..utils.rate_limit import acquire_stk_push
+from ..utils.settings_cache import get_mpesa_settings
+
+
+def get_stk_push_outcome(result) -> str:
+	if result.get("status_code") == 429:
+		return "throttled"
+	if result.get("status_code") == 503:
+		return "unavailable"
+	if result.get("error"):
+		return "error"
+	response = (result.get("response") or {}).get("response") or {}
+	return "accepted" if response.get("ResponseCode") == "0" else "rejected"
+
 
 @frappe.whitelist()
+@instrument("stk_push", get_outcome=get_stk_push_outcome)
 def generate_stk_push(**args) -> any:
 	# If args is a single key "args" containing a JSON string, parse it
 	if len(args) == 1 and "args" in args:
@@ -22,9 +40,14 @@ def generate_stk_push(**args) -> any:
 	else:
 		args = frappe._dict(args)
 
-	settings = frappe.get_doc("KCB Mpesa Settings", args.get("settings"))
+	settings = get_mpesa_settings(args.get("settings"))
 	kcb_mpesa_stk_request = frappe.get_doc("KCB Mpesa STK Request", args.get("kcb_mpesa_stk_request"))
-	access_token = settings.get_access_token()
+	set_till(settings.till_no)
+
+	try:
+		access_token = settings.get_access_token()
+	except CircuitOpenError as e:
+		return mark_unavailable(kcb_mpesa_stk_request, e)
 
 	if not args.get("callback_url"):
 		from ..utils.utils import get_stk_push_callback
@@ -40,8 +63,7 @@ def generate_stk_push(**args) -> any:
 	if not access_token:
 		frappe.throw("Failed to retrieve access token. Please check KCB Mpesa Settings.")
 
-	base_url = "https://uat.buni.kcbgroup.com" if settings.sandbox else "https://api.buni.kcbgroup.com"
-	url = f"{base_url}/mm/api/request/1.0.0/stkpush"
+	url = buni_client.get_base_url(settings.sandbox) + buni_client.STK_PUSH_PATH
 
 	message_id = f"{int(time.time())}_KCBOrg_{uuid.uuid4().hex[:10]}"
 
@@ -77,8 +99,22 @@ def generate_stk_push(**args) -> any:
 		}
 	)
 
+	if not acquire_stk_push(settings):
+		kcb_mpesa_stk_request.status = "Throttled"
+		kcb_mpesa_stk_request.error_message = "Throttled"
+		kcb_mpesa_stk_request.error_description = _(
+			"Too many STK pushes for till {0}, please retry shortly."
+		).format(settings.till_no or settings.name)
+		kcb_mpesa_stk_request.save(ignore_permissions=True)
+		frappe.db.commit()
+		return {"status_code": 429, "error": "Throttled"}
+
 	try:
-		response = requests.post(url, headers=headers, json=payload, timeout=10)
+		with track("buni_stkpush", till=settings.till_no) as call:
+			response = buni_client.post(
+				settings.sandbox, buni_client.STK_PUSH_PATH, headers=headers, json=payload
+			)
+			call.outcome = f"{response.status_code // 100}xx"
 		response_text = response.text
 
 		try:
@@ -116,7 +152,8 @@ def generate_stk_push(**args) -> any:
 
 		# Non-200 response (Invalid credentials, etc.)
 		elif response.status_code >= 400:
-			kcb_mpesa_stk_request.status = "Failed"
+			# KCB throttling us is worth a retry, unlike a rejected request
+			kcb_mpesa_stk_request.status = "Throttled" if response.status_code == 429 else "Failed"
 			kcb_mpesa_stk_request.response_code = response_json.get("code", "")
 			kcb_mpesa_stk_request.error_message = response_json.get("message", "")
 			kcb_mpesa_stk_request.error_description = response_json.get("description", response_text)
@@ -130,6 +167,9 @@ def generate_stk_push(**args) -> any:
 
 		return {"status_code": response.status_code, "response": response_json}
 
+	except CircuitOpenError as e:
+		return mark_unavailable(kcb_mpesa_stk_request, e)
+
 	except requests.exceptions.RequestException as e:
 		frappe.log_error("KCB Mpesa STK Push Failed", f"Network error: {e!s}")
 		kcb_mpesa_stk_request.status = "Failed"
@@ -147,3 +187,13 @@ def generate_stk_push(**args) -> any:
 		kcb_mpesa_stk_request.save(ignore_permissions=True)
 		frappe.db.commit()
 		return {"status_code": 500, "error": str(e)}
+
+
+def mark_unavailable(kcb_mpesa_stk_request, error) -> dict:
+	"""Fail fast while the Buni circuit breaker is open"""
+	kcb_mpesa_stk_request.status = "Unavailable"
+	kcb_mpesa_stk_request.error_message = "KCB unavailable"
+	kcb_mpesa_stk_request.error_description = str(error)
+	kcb_mpesa_stk_request.save(ignore_permissions=True)
+	frappe.db.commit()
+	return {"status_code": 503, "error": "Unavailable"}
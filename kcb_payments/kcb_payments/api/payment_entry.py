@@ -13,6 +13,7 @@ from erpnext.accounts.utils import QueryPaymentLedger, get_account_currency
 from erpnext.setup.utils import get_exchange_rate
 from frappe import _, qb
 from frappe.utils import (
+    add_days,
     flt,
     getdate,
     nowdate,
@@ -22,6 +23,12 @@ from frappe_mpsa_payments.frappe_mpsa_payments.api.m_pesa_api import (
     submit_mpesa_payment,
 )
 
+from ..utils.transaction_search import (
+    add_cursors,
+    get_search_conditions,
+    get_unreconciled_query,
+)
+
 
 def create_payment_entry(
     company,
@@ -564,48 +571,33 @@ def process_mpesa_c2b_customer_credit():
 
 
 @frappe.whitelist()
-def get_unreconciled_kcb_payments(full_name=None, from_date=None, to_date=None):
-    filters = {
-        "status": ["in", ["Partly Reconciled", "Unreconciled"]],
-    }
-
-    if from_date and to_date:
-        filters["transaction_date"] = ["between", [from_date, to_date]]
-    elif from_date:
-        filters["transaction_date"] = [">=", from_date]
-    elif to_date:
-        filters["transaction_date"] = ["<=", to_date]
-
-    or_filters = []
-    if full_name:
-        or_filters = [
-            ["first_name", "like", f"%{full_name}%"],
-            ["middle_name", "like", f"%{full_name}%"],
-            ["last_name", "like", f"%{full_name}%"],
-        ]
-
-    transactions = frappe.get_all(
-        "KCB Payment Transaction",
-        filters=filters,
-        or_filters=or_filters if or_filters else None,
-        fields=[
-            "name",
-            "mobile_number",
-            "first_name",
-            "last_name",
-            "amount",
-            "reconciled",
-            "originator_conversation_id",
-            "transaction_date",
-        ],
-        order_by="creation desc",
+def get_unreconciled_kcb_payments(
+    full_name=None, from_date=None, to_date=None, cursor=None, page_length=None
+):
+    transaction = frappe.qb.DocType("KCB Payment Transaction")
+    query = get_unreconciled_query(transaction, cursor, page_length).select(
+        transaction.name,
+        transaction.mobile_number,
+        transaction.first_name,
+        transaction.last_name,
+        transaction.amount,
+        transaction.reconciled,
+        (transaction.remaining_cents / 100).as_("unreconciled_amount"),
+        transaction.originator_conversation_id,
+        transaction.transaction_date,
+        transaction.transaction_datetime,
     )
 
-    # Calculate unreconciled amount
-    for t in transactions:
-        t["unreconciled_amount"] = t["amount"] - t["reconciled"]
+    if from_date:
+        query = query.where(transaction.transaction_datetime >= getdate(from_date))
+    if to_date:
+        # up to the end of to_date
+        query = query.where(transaction.transaction_datetime < add_days(getdate(to_date), 1))
+
+    for condition in get_search_conditions(transaction, name=full_name):
+        query = query.where(condition)
 
-    return transactions
+    return add_cursors(query.run(as_dict=True))
 
 
 def submit_kcb_payment(kcb_name, customer, company):
@@ -615,7 +607,7 @@ def submit_kcb_payment(kcb_name, customer, company):
         if kcb_doc.status == "Reconciled":
             frappe.throw(_("KCB Payment has already been fully reconciled."))
 
-        reconcilable_amount = kcb_doc.amount - kcb_doc.reconciled
+        reconcilable_amount = kcb_doc.remaining_cents / 100
 
         if reconcilable_amount <= 0:
             frappe.throw(_("KCB Payment has been used up, cannot be used for further reconciliation"))
@@ -0,0 +1,133 @@
+"""Benchmark for the pooled Buni client against a local keep-alive HTTPS server.
+
+Compares a bare `requests.post` per call (the old behaviour, a new TCP and
+TLS handshake every time) with the process wide session from buni_client.
+The mock server answers instantly, so the difference is the connection setup.
+
+Run from the app directory inside the bench virtualenv:
+
+	python -m kcb_payments.kcb_payments.benchmarks.buni_client
+"""
+
+import datetime
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from ..utils.buni_client import STK_PUSH_PATH, make_session
+
+RESPONSE = json.dumps(
+	{
+		"response": {
+			"MerchantRequestID": "7071-4170-a0e5-8345632bad4421",
+			"CheckoutRequestID": "ws_CO_0312202522154112345678",
+			"ResponseCode": "0",
+			"ResponseDescription": "Success. Request accepted for processing",
+			"CustomerMessage": "Success. Request accepted for processing",
+		}
+	}
+).encode()
+
+
+class MockBuniHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	disable_nagle_algorithm = True
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(RESPONSE)))
+		self.end_headers()
+		self.wfile.write(RESPONSE)
+
+	def log_message(self, format, *args):
+		pass
+
+
+def make_certificate(directory):
+	key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+	name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+	now = datetime.datetime.now(datetime.timezone.utc)
+	certificate = (
+		x509.CertificateBuilder()
+		.subject_name(name)
+		.issuer_name(name)
+		.public_key(key.public_key())
+		.serial_number(x509.random_serial_number())
+		.not_valid_before(now)
+		.not_valid_after(now + datetime.timedelta(days=1))
+		.add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+		.sign(key, hashes.SHA256())
+	)
+
+	cert_path = os.path.join(directory, "cert.pem")
+	key_path = os.path.join(directory, "key.pem")
+	with open(cert_path, "wb") as f:
+		f.write(certificate.public_bytes(serialization.Encoding.PEM))
+	with open(key_path, "wb") as f:
+		f.write(
+			key.private_bytes(
+				serialization.Encoding.PEM,
+				serialization.PrivateFormat.TraditionalOpenSSL,
+				serialization.NoEncryption(),
+			)
+		)
+	return cert_path, key_path
+
+
+def start_server(cert_path, key_path):
+	server = ThreadingHTTPServer(("localhost", 0), MockBuniHandler)
+	context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+	context.load_cert_chain(cert_path, key_path)
+	server.socket = context.wrap_socket(server.socket, server_side=True)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+def measure(fn, iterations):
+	start = time.perf_counter()
+	for _ in range(iterations):
+		fn()
+	elapsed = time.perf_counter() - start
+	return iterations / elapsed, elapsed / iterations * 1000
+
+
+def run(iterations=500):
+	payload = {"phoneNumber": "254712345678", "amount": "1", "invoiceNumber": "7504343#ACC-SINV-2026-00780"}
+
+	with tempfile.TemporaryDirectory() as directory:
+		cert_path, key_path = make_certificate(directory)
+		server = start_server(cert_path, key_path)
+		base_url = f"https://localhost:{server.server_address[1]}"
+		url = base_url + STK_PUSH_PATH
+
+		session = make_session(base_url)
+
+		before, before_ms = measure(
+			lambda: requests.post(url, json=payload, verify=cert_path, timeout=10), iterations
+		)
+		after, after_ms = measure(
+			lambda: session.post(url, json=payload, verify=cert_path, timeout=10), iterations
+		)
+
+		server.shutdown()
+
+	print(f"new connection per call: {before:8.0f} requests/sec ({before_ms:.2f} ms each)")
+	print(f"pooled session         : {after:8.0f} requests/sec ({after_ms:.2f} ms each)")
+	print(f"speed-up               : {after / before:8.2f}x")
+	print("(against Buni the saving per call also includes the network round trips of the handshake)")
+
+
+if __name__ == "__main__":
+	run()
@@ -0,0 +1,92 @@
+"""Micro-benchmark for KCB IPN signature verification.
+
+Compares parsing the PEM on every notification (the old `verify_signature`
+behaviour, minus its settings lookup) with the process wide SignatureVerifier.
+
+Run from the app directory inside the bench virtualenv:
+
+	python -m kcb_payments.kcb_payments.benchmarks.signature_verification
+"""
+
+import base64
+import json
+import time
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from ..utils.signature import SignatureVerifier
+
+PAYLOAD = {
+	"header": {
+		"messageID": "232323_KCBOrg_8875661561",
+		"originatorConversationID": "TL1AB2CD3E",
+		"channelCode": "206",
+		"timeStamp": "2025-12-03T22:15:41.123",
+	},
+	"requestPayload": {
+		"additionalData": {
+			"notificationData": {
+				"businessKey": "7504343#ACC-SINV-2026-00780",
+				"businessKeyType": "Till",
+				"debitMSISDN": "254712345678",
+				"transactionAmt": 1500.0,
+				"transactionDate": "20251203221541",
+				"transactionID": "FT25337XYZ12",
+				"firstName": "JOHN",
+				"middleName": "",
+				"lastName": "DOE",
+				"currency": "KES",
+				"narration": "Payment for invoice",
+				"transactionType": "C",
+				"balance": "",
+			}
+		}
+	},
+}
+
+
+def make_key_pair():
+	private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+	pem = private_key.public_key().public_bytes(
+		serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+	)
+	return private_key, pem.decode()
+
+
+def verify_uncached(pem, payload, signature):
+	public_key = serialization.load_pem_public_key(pem.encode())
+	public_key.verify(base64.b64decode(signature), payload, padding.PKCS1v15(), hashes.SHA256())
+	return True
+
+
+def measure(fn, iterations):
+	start = time.perf_counter()
+	for _ in range(iterations):
+		fn()
+	elapsed = time.perf_counter() - start
+	return iterations / elapsed
+
+
+def run(iterations=2000):
+	private_key, pem = make_key_pair()
+	_, rotated_pem = make_key_pair()
+
+	payload = json.dumps(PAYLOAD, separators=(",", ":")).encode()
+	signature = base64.b64encode(private_key.sign(payload, padding.PKCS1v15(), hashes.SHA256())).decode()
+
+	verifier = SignatureVerifier()
+	# the signing key is listed second, as it would be mid-rotation
+	verifier.load(f"{rotated_pem}\n{pem}", version="bench")
+
+	before = measure(lambda: verify_uncached(pem, payload, signature), iterations)
+	after = measure(lambda: verifier.verify(payload, signature), iterations)
+
+	print(f"parse per call : {before:10.0f} verifications/sec")
+	print(f"cached verifier: {after:10.0f} verifications/sec ({len(verifier.keys)} active keys)")
+	print(f"speed-up       : {after / before:10.2f}x")
+	print("(the old path also read the key from site config or the database on every call)")
+
+
+if __name__ == "__main__":
+	run()
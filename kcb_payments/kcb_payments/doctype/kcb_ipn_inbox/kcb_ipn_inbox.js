@@ -0,0 +1,19 @@
+// Copyright (c) 2026, Team Web Africa and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("KCB IPN Inbox", {
+	refresh(frm) {
+		if (["Failed", "Poisoned"].includes(frm.doc.status)) {
+			frm.add_custom_button(__("Requeue"), function () {
+				frappe.call({
+					method: "kcb_payments.kcb_payments.utils.ipn_inbox.requeue_inbox_entry",
+					args: { name: frm.doc.name },
+					freeze: true,
+					callback: function () {
+						frm.reload_doc();
+					},
+				});
+			});
+		}
+	},
+});
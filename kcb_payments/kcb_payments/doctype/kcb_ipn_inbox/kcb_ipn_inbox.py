@@ -0,0 +1,13 @@
+# Copyright (c) 2026, Team Web Africa and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class KCBIPNInbox(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("KCB IPN Inbox", ["status", "creation"])
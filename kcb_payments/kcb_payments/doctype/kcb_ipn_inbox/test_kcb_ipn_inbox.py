@@ -0,0 +1,87 @@
+# Copyright (c) 2026, Team Web Africa and Contributors
+# See license.txt
+
+import threading
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now
+
+from ...utils.ipn_inbox import claim_batch, mark_failed, release_stale_claims
+
+
+def make_inbox_entry(**kwargs):
+	entry = frappe.get_doc(
+		{
+			"doctype": "KCB IPN Inbox",
+			"kcb_transaction_id": frappe.generate_hash(length=12).upper(),
+			"message_id": "1764791741_KCBOrg_test",
+			"payload": "{}",
+			"status": "Pending",
+			**kwargs,
+		}
+	)
+	entry.insert(ignore_permissions=True)
+	return entry.name
+
+
+def run_in_other_connection(method, *args):
+	"""Call `method` from a thread with its own database connection, as a second worker would"""
+	site, sites_path = frappe.local.site, frappe.local.sites_path
+	result = []
+
+	def target():
+		frappe.init(site=site, sites_path=sites_path)
+		try:
+			frappe.connect()
+			result.append(method(*args))
+		finally:
+			frappe.destroy()
+
+	thread = threading.Thread(target=target)
+	thread.start()
+	thread.join()
+	return result[0]
+
+
+class TestKCBIPNInbox(FrappeTestCase):
+	def test_claim_skips_entries_locked_by_another_worker(self):
+		locked, free = make_inbox_entry(), make_inbox_entry()
+		frappe.db.commit()
+
+		frappe.db.sql("select name from `tabKCB IPN Inbox` where name = %s for update", locked)
+		claimed = run_in_other_connection(claim_batch, 1000)
+		frappe.db.rollback()
+
+		self.assertIn(free, claimed)
+		self.assertNotIn(locked, claimed)
+		self.assertEqual(frappe.db.get_value("KCB IPN Inbox", free, "status"), "Processing")
+		self.assertEqual(frappe.db.get_value("KCB IPN Inbox", locked, "status"), "Pending")
+
+	def test_stale_claims_are_poisoned_after_max_retries(self):
+		stale_since = add_to_date(now(), minutes=-30)
+		retried, exhausted = make_inbox_entry(), make_inbox_entry()
+		for name, retry_count in ((retried, 0), (exhausted, 4)):
+			frappe.db.set_value(
+				"KCB IPN Inbox",
+				name,
+				{"status": "Processing", "retry_count": retry_count, "modified": stale_since},
+				update_modified=False,
+			)
+
+		release_stale_claims(max_retries=5)
+
+		self.assertEqual(
+			frappe.db.get_value("KCB IPN Inbox", retried, ["status", "retry_count"]), ("Failed", 1)
+		)
+		self.assertEqual(
+			frappe.db.get_value("KCB IPN Inbox", exhausted, ["status", "retry_count"]), ("Poisoned", 5)
+		)
+
+	def test_failed_entry_is_poisoned_after_max_retries(self):
+		name = make_inbox_entry(retry_count=4)
+		entry = frappe._dict(name=name, retry_count=4)
+
+		mark_failed(entry, max_retries=5, error="Traceback")
+
+		self.assertEqual(frappe.db.get_value("KCB IPN Inbox", name, "status"), "Poisoned")
@@ -4,6 +4,9 @@
 # import frappe
 from frappe.model.document import Document
 
+from ...utils.signature import clear_signature_verifier_cache
+
 
 class KCBIPNSettings(Document):
-	pass
+	def on_update(self):
+		clear_signature_verifier_cache()
@@ -1,8 +1,29 @@
 // Copyright (c) 2025, Team Web Africa and contributors
 // For license information, please see license.txt
 
-// frappe.ui.form.on("KCB Mpesa Settings", {
-// 	refresh(frm) {
+frappe.ui.form.on("KCB Mpesa Settings", {
+	refresh(frm) {
+		if (frm.is_new()) return;
 
-// 	},
-// });
+		frappe.call({
+			method: "kcb_payments.kcb_payments.utils.circuit_breaker.get_circuit_states",
+			args: { sandbox: frm.doc.sandbox },
+			callback: function (r) {
+				if (!r.message) return;
+
+				const colors = { Closed: "green", "Half Open": "orange", Open: "red" };
+				const states = Object.entries(r.message)
+					.map(
+						([endpoint, state]) =>
+							`<span class="indicator-pill ${colors[state]}">${__(
+								"KCB {0}: {1}",
+								[endpoint, __(state)]
+							)}</span>`
+					)
+					.join(" ");
+
+				frm.dashboard.set_headline(states);
+			},
+		});
+	},
+});
@@ -7,10 +7,15 @@ import frappe
 import requests
 from frappe import _
 from frappe.model.document import Document
-from frappe.utils import add_to_date
+from frappe.utils import cint
 from frappe.utils.password import get_decrypted_password
 from requests.auth import HTTPBasicAuth
 
+from ...utils import buni_client
+from ...utils.circuit_breaker import CircuitOpenError
+from ...utils.metrics import track
+from ...utils.settings_cache import clear_mpesa_settings_cache
+from ...utils.token_cache import clear_cached_token, get_access_token
 from ...utils.utils import (
 	create_payment_gateway,
 	create_payment_gateway_account,
@@ -18,6 +23,9 @@ from ...utils.utils import (
 	sanitize_mobile_number,
 )
 
+# used when Buni leaves out expires_in
+DEFAULT_TOKEN_LIFETIME = 3599
+
 
 class KCBMpesaSettings(Document):
 	"""Validate the currency is supported for KCB MPesa"""
@@ -57,59 +65,40 @@ class KCBMpesaSettings(Document):
 
 		return username, password
 
-	def token_expired(self) -> bool:
-		if not self.access_token or not self.token_expiry:
-			return True
-
-		try:
-			from frappe.utils import get_datetime
-
-			expiry_time = get_datetime(self.token_expiry)
-			buffer_time = add_to_date(expiry_time, seconds=-5)
-
-			return get_datetime(frappe.utils.now()) >= buffer_time
-		except (AttributeError, TypeError, ValueError) as e:
-			frappe.log_error(
-				title="Token Expiry Check Failed",
-				message=f"Error checking token expiry for {self.name}: {e!s}",
-			)
-			return True
-
 	def get_access_token(self) -> str | None:
-		if not self.token_expired():
-			try:
-				return get_decrypted_password("KCB Mpesa Settings", self.name, "access_token")
-			except Exception:
-				# Token field exists, decryption failed, fetch new token
-				pass
+		return get_access_token(self)
 
+	def request_access_token(self) -> frappe._dict | None:
+		"""Fetch a new token from Buni. Use `get_access_token`, which shares it between workers."""
 		consumer_key, consumer_secret = self.get_credentials()
 
 		if not consumer_key or not consumer_secret:
 			frappe.throw("KCB Mpesa credentials not found. Please check your settings.")
 			return None
 
-		base_url = "https://uat.buni.kcbgroup.com" if self.sandbox else "https://api.buni.kcbgroup.com"
-		url = f"{base_url}/token?grant_type=client_credentials"
-
 		try:
-			response = requests.post(url, auth=HTTPBasicAuth(consumer_key, consumer_secret))
+			with track("buni_token", till=self.till_no) as call:
+				response = buni_client.post(
+					self.sandbox,
+					buni_client.TOKEN_PATH,
+					params={"grant_type": "client_credentials"},
+					auth=HTTPBasicAuth(consumer_key, consumer_secret),
+				)
+				call.outcome = f"{response.status_code // 100}xx"
 			if response.status_code >= 200 and response.status_code < 300:
 				token_data = response.json()
-				self.access_token = token_data.get("access_token")
-				self.expires_in = token_data.get("expires_in")
-
-				self.token_expiry = add_to_date(frappe.utils.now(), seconds=self.expires_in)
-
-				self.save(ignore_permissions=True)
-				frappe.db.commit()
-				return token_data.get("access_token")
+				return frappe._dict(
+					access_token=token_data.get("access_token"),
+					expires_in=cint(token_data.get("expires_in")) or DEFAULT_TOKEN_LIFETIME,
+				)
 			else:
 				frappe.log_error(
 					title="Refresh token failed",
 					message=f"Could not refresh token. Response:\n{response.text}",
 				)
 				return None
+		except CircuitOpenError:
+			raise
 		except requests.exceptions.RequestException as e:
 			frappe.log_error(
 				title="Refresh token failed",
@@ -121,6 +110,10 @@ class KCBMpesaSettings(Document):
 			return None
 
 	def on_update(self) -> None:
+		# credentials or environment may have changed
+		clear_cached_token(self.name)
+		clear_mpesa_settings_cache()
+
 		create_payment_gateway(
 			"KCB Mpesa-" + self.payment_gateway_name,
 			settings="KCB Mpesa Settings",
@@ -140,6 +133,9 @@ class KCBMpesaSettings(Document):
 			"KCB Mpesa-" + self.payment_gateway_name, payment_type="Phone", company=self.company
 		)
 
+	def on_trash(self) -> None:
+		clear_mpesa_settings_cache()
+
 	def request_for_payment(self, **kwargs) -> None:
 		args = frappe._dict(kwargs)
 
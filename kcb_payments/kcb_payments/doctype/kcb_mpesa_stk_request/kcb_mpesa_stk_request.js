@@ -3,7 +3,7 @@
 
 frappe.ui.form.on("KCB Mpesa STK Request", {
 	refresh(frm) {
-		if (frm.doc.status == "Failed") {
+		if (["Failed", "Throttled", "Unavailable"].includes(frm.doc.status)) {
 			frm.add_custom_button(__("Retry STK Push"), function () {
 				frappe.call({
 					method: "kcb_payments.kcb_payments.api.kcb_mpesa.generate_stk_push",
@@ -24,6 +24,14 @@ frappe.ui.form.on("KCB Mpesa STK Request", {
 								frappe.msgprint(
 									__("Please check your phone to complete the payment.")
 								);
+							} else if (response.message.status_code == 429) {
+								frappe.msgprint(
+									__("Too many STK pushes for this till, please retry shortly.")
+								);
+							} else if (response.message.status_code == 503) {
+								frappe.msgprint(
+									__("KCB is currently unavailable, please retry shortly.")
+								);
 							} else {
 								console.log(response.message.response);
 								frappe.msgprint(
@@ -35,5 +43,18 @@ frappe.ui.form.on("KCB Mpesa STK Request", {
 				});
 			});
 		}
+
+		if (["Failed", "Poisoned"].includes(frm.doc.post_processing_status)) {
+			frm.add_custom_button(__("Requeue Post Processing"), function () {
+				frappe.call({
+					method: "kcb_payments.kcb_payments.utils.stk_post_processing.requeue_post_processing",
+					args: { name: frm.doc.name },
+					freeze: true,
+					callback: function () {
+						frm.reload_doc();
+					},
+				});
+			});
+		}
 	},
 });
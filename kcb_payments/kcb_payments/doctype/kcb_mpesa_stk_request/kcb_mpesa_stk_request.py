@@ -5,14 +5,33 @@ import frappe
 from frappe.model.document import Document
 
 from ...api.kcb_mpesa import generate_stk_push
+from ...utils.settings_cache import get_mpesa_settings
+from ...utils.stk_dispatch import enqueue_stk_push
 from ...utils.utils import get_stk_push_callback
 
 
 class KCBMpesaSTKRequest(Document):
+	def before_submit(self):
+		if self.flags.defer_stk_push or get_mpesa_settings(self.kcb_mpesa_settings).queue_stk_push:
+			self.status = "Queued"
+
 	def on_submit(self):
-		is_sandbox = bool(frappe.db.get_value("KCB Mpesa Settings", self.kcb_mpesa_settings, "sandbox"))
+		if self.status == "Queued":
+			# deferred requests are sent by whoever created them, e.g. a bulk push
+			if not self.flags.defer_stk_push:
+				enqueue_stk_push(self.name)
+			return
+
+		try:
+			generate_stk_push(**self.get_stk_push_args())
+		except Exception as e:
+			frappe.log_error(frappe.get_traceback(), "KCB STK Push on Submit Error")
+			frappe.throw(f"Failed to initiate KCB STK Push: {e!s}")
 
-		args = {
+	def get_stk_push_args(self) -> dict:
+		is_sandbox = bool(get_mpesa_settings(self.kcb_mpesa_settings).sandbox)
+
+		return {
 			"phone_number": self.phone_number,
 			"request_amount": self.amount,
 			"invoice_number": f"{self.till_no}-{self.reference_name}",
@@ -23,8 +42,8 @@ class KCBMpesaSTKRequest(Document):
 			"kcb_mpesa_stk_request": str(self.name),
 		}
 
-		try:
-			generate_stk_push(**args)
-		except Exception as e:
-			frappe.log_error(frappe.get_traceback(), "KCB STK Push on Submit Error")
-			frappe.throw(f"Failed to initiate KCB STK Push: {e!s}")
+
+def on_doctype_update():
+	frappe.db.add_index("KCB Mpesa STK Request", ["mpesa_receipt_number", "status"])
+	# overdue In Progress requests for the sweeper
+	frappe.db.add_index("KCB Mpesa STK Request", ["status", "timestamp"])
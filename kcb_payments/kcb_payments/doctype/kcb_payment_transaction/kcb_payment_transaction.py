@@ -1,9 +1,28 @@
 # Copyright (c) 2025, Team Web Africa and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
+from ...utils.ipn import get_cents_values, parse_transaction_datetime
+from ...utils.transaction_search import add_fulltext_index, get_search_values
+
 
 class KCBPaymentTransaction(Document):
-	pass
+	def validate(self):
+		self.update(get_search_values(self.as_dict()))
+		self.update(get_cents_values(self.amount, self.reconciled))
+		if not self.transaction_datetime:
+			self.transaction_datetime = parse_transaction_datetime(self.as_dict())
+
+	def before_update_after_submit(self):
+		# reconciliation updates the submitted transaction
+		self.update(get_cents_values(self.amount, self.reconciled))
+
+
+def on_doctype_update():
+	# unreconciled listings page through status, newest first
+	frappe.db.add_index("KCB Payment Transaction", ["status", "creation"])
+	# exact remaining amount lookups for search and matching
+	frappe.db.add_index("KCB Payment Transaction", ["status", "remaining_cents"])
+	add_fulltext_index()
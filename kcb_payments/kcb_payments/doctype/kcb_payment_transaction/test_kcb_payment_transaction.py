@@ -1,9 +1,97 @@
 # Copyright (c) 2025, Team Web Africa and Contributors
 # See license.txt
 
-# import frappe
+import random
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from ...utils.bulk_ingest import bulk_create_payment_transactions
+from ...utils.kcb_payment_notification import create_payment_transaction, fetch_kcb_payment_transactions
+
+
+def make_notification_fields(**kwargs):
+	fields = frappe._dict(
+		message_id="1764791741_KCBOrg_test",
+		originator_conversation_id="",
+		channel_code="206",
+		timestamp="2025-12-03T22:15:41.123",
+		bill_reference="7504343#TEST-REF",
+		mobile_number="254712345678",
+		amount=100,
+		transaction_date="20251203221541",
+		kcb_transaction_id=frappe.generate_hash(length=12).upper(),
+		first_name="JOHN",
+		middle_name="",
+		last_name="DOE",
+		currency="KES",
+		narration="",
+		transaction_type="C",
+		balance="",
+	)
+	fields.update(kwargs)
+	return fields
+
 
 class TestKCBPaymentTransaction(FrappeTestCase):
-	pass
+	def test_redelivered_notification_is_not_duplicated(self):
+		fields = make_notification_fields()
+
+		first = create_payment_transaction(fields)
+		second = create_payment_transaction(fields)
+
+		self.assertFalse(first.duplicate)
+		self.assertTrue(second.duplicate)
+		self.assertEqual(first.name, second.name)
+		self.assertEqual(
+			frappe.db.count("KCB Payment Transaction", {"kcb_transaction_id": fields.kcb_transaction_id}), 1
+		)
+		self.assertEqual(frappe.db.get_value("KCB Payment Transaction", first.name, "docstatus"), 1)
+
+	def test_bulk_create_reports_per_row_outcomes(self):
+		existing = make_notification_fields()
+		create_payment_transaction(existing)
+
+		new = make_notification_fields()
+		invalid = make_notification_fields(kcb_transaction_id="")
+
+		outcomes = bulk_create_payment_transactions([new, existing, new, invalid])
+
+		self.assertEqual([o.status for o in outcomes], ["Created", "Duplicate", "Duplicate", "Invalid"])
+		self.assertEqual(outcomes[0].name, outcomes[2].name)
+		self.assertEqual(
+			frappe.db.get_value("KCB Payment Transaction", outcomes[0].name, ["docstatus", "status"]),
+			(1, "Unreconciled"),
+		)
+
+	def test_bulk_create_reports_name_collision_as_error(self):
+		new, existing = make_notification_fields(), make_notification_fields()
+		create_payment_transaction(existing)
+
+		taken = bulk_create_payment_transactions([make_notification_fields()])[0].name
+		# a series counter that is behind hands out the name just used
+		frappe.db.sql("update `tabSeries` set current = current - 1 where name = %s", taken[:-5])
+
+		outcomes = bulk_create_payment_transactions([new, existing])
+
+		self.assertEqual([o.status for o in outcomes], ["Error", "Duplicate"])
+		self.assertIsNone(outcomes[0].name)
+		self.assertFalse(
+			frappe.db.exists("KCB Payment Transaction", {"kcb_transaction_id": new.kcb_transaction_id})
+		)
+
+	def test_unreconciled_pages_follow_cursor(self):
+		mobile_number = f"2547{random.randrange(10**8):08d}"
+		outcomes = bulk_create_payment_transactions(
+			[make_notification_fields(mobile_number=mobile_number) for _ in range(5)]
+		)
+
+		pages, cursor = [], None
+		while page := fetch_kcb_payment_transactions(
+			phone_number=mobile_number, cursor=cursor, page_length=2
+		):
+			pages.append(page)
+			cursor = page[-1]["cursor"]
+
+		self.assertEqual([len(page) for page in pages], [2, 2, 1])
+		self.assertCountEqual([row["name"] for page in pages for row in page], [o.name for o in outcomes])
@@ -1,6 +1,8 @@
 // Copyright (c) 2024, Navari Limited and contributors
 // For license information, please see license.txt
 
+const KCB_PAYMENTS_PAGE_LENGTH = 100;
+
 frappe.ui.form.on("KCB Payments Reconciliation", {
 	onload(frm) {
 		const default_company = frappe.defaults.get_user_default("Company");
@@ -72,33 +74,55 @@ frappe.ui.form.on("KCB Payments Reconciliation", {
 			},
 		});
 
-		// Fetch unreconciled KCB payments
+		// Fetch the first page of unreconciled KCB payments, later pages load on demand
+		frm.kcb_payments_cursor = null;
+		frm.trigger("fetch_kcb_payments");
+	},
+
+	fetch_kcb_payments(frm) {
+		const first_page = !frm.kcb_payments_cursor;
+
 		frappe.call({
 			method: "kcb_payments.kcb_payments.api.payment_entry.get_unreconciled_kcb_payments",
 			args: {
 				full_name: frm.doc.full_name || "",
 				from_date: frm.doc.from_mpesa_payment_date || "",
 				to_date: frm.doc.to_mpesa_payment_date || "",
+				cursor: frm.kcb_payments_cursor,
+				page_length: KCB_PAYMENTS_PAGE_LENGTH,
 			},
 			callback: function (response) {
-				let kcb_payments = response.message;
-
-				frm.clear_table("mpesa_payments");
+				let kcb_payments = response.message || [];
 
-				if (kcb_payments && kcb_payments.length > 0) {
-					kcb_payments.forEach(function (payment) {
-						let row = frm.add_child("mpesa_payments");
-						row.payment_id = payment.name;
-						row.full_name = payment.first_name;
-						row.date = payment.transaction_date;
-						row.amount = payment.unreconciled_amount;
-					});
+				if (first_page) {
+					frm.clear_table("mpesa_payments");
 				}
 
+				kcb_payments.forEach(function (payment) {
+					let row = frm.add_child("mpesa_payments");
+					row.payment_id = payment.name;
+					row.full_name = payment.first_name;
+					row.date = payment.transaction_datetime && payment.transaction_datetime.split(" ")[0];
+					row.amount = payment.unreconciled_amount;
+				});
+
 				frm.refresh_field("mpesa_payments");
 				check_for_process_payments_button(frm);
 
-				if (frm.doc.invoices.length === 0 && frm.doc.mpesa_payments.length === 0) {
+				// a full page means there may be more
+				frm.remove_custom_button(__("Load More KCB Payments"));
+				if (kcb_payments.length === KCB_PAYMENTS_PAGE_LENGTH) {
+					frm.kcb_payments_cursor = kcb_payments[kcb_payments.length - 1].cursor;
+					frm.add_custom_button(__("Load More KCB Payments"), () => {
+						frm.trigger("fetch_kcb_payments");
+					});
+				}
+
+				if (
+					first_page &&
+					frm.doc.invoices.length === 0 &&
+					frm.doc.mpesa_payments.length === 0
+				) {
 					frappe.msgprint({
 						title: __("No Entries Found"),
 						message: __(
@@ -0,0 +1,19 @@
+// Copyright (c) 2026, Team Web Africa and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["KCB STK Post Processing Failures"] = {
+	filters: [
+		{
+			fieldname: "status",
+			label: __("Status"),
+			fieldtype: "Select",
+			options: "\nFailed\nPoisoned",
+		},
+		{
+			fieldname: "kcb_mpesa_settings",
+			label: __("KCB Mpesa Settings"),
+			fieldtype: "Link",
+			options: "KCB Mpesa Settings",
+		},
+	],
+};
@@ -0,0 +1,68 @@
+# Copyright (c) 2026, Team Web Africa and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+
+
+def execute(filters=None):
+	return get_columns(), get_data(frappe._dict(filters or {}))
+
+
+def get_columns():
+	return [
+		{
+			"label": _("STK Request"),
+			"fieldname": "name",
+			"fieldtype": "Link",
+			"options": "KCB Mpesa STK Request",
+			"width": 180,
+		},
+		{"label": _("Status"), "fieldname": "post_processing_status", "fieldtype": "Data", "width": 100},
+		{"label": _("Retries"), "fieldname": "post_processing_retry_count", "fieldtype": "Int", "width": 80},
+		{"label": _("Reference Type"), "fieldname": "reference_doctype", "fieldtype": "Data", "width": 130},
+		{
+			"label": _("Reference"),
+			"fieldname": "reference_name",
+			"fieldtype": "Dynamic Link",
+			"options": "reference_doctype",
+			"width": 160,
+		},
+		{"label": _("Receipt"), "fieldname": "mpesa_receipt_number", "fieldtype": "Data", "width": 120},
+		{"label": _("Amount"), "fieldname": "transaction_amount", "fieldtype": "Currency", "width": 110},
+		{
+			"label": _("Callback Received At"),
+			"fieldname": "callback_received_at",
+			"fieldtype": "Datetime",
+			"width": 160,
+		},
+		{
+			"label": _("Last Error"),
+			"fieldname": "post_processing_error",
+			"fieldtype": "Small Text",
+			"width": 400,
+		},
+	]
+
+
+def get_data(filters):
+	conditions = {"post_processing_status": filters.status or ["in", ["Failed", "Poisoned"]]}
+	if filters.kcb_mpesa_settings:
+		conditions["kcb_mpesa_settings"] = filters.kcb_mpesa_settings
+
+	return frappe.get_all(
+		"KCB Mpesa STK Request",
+		filters=conditions,
+		fields=[
+			"name",
+			"post_processing_status",
+			"post_processing_retry_count",
+			"reference_doctype",
+			"reference_name",
+			"mpesa_receipt_number",
+			"transaction_amount",
+			"callback_received_at",
+			"post_processing_error",
+		],
+		order_by="callback_received_at desc",
+	)
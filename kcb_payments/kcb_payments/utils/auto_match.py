@@ -0,0 +1,82 @@
+"""Reconcile new KCB payments against the Sales Invoice in their bill reference.
+
+With "Auto Match Invoices" enabled on the KCB IPN Settings, every
+Unreconciled transaction created at ingest is handed to a background job. It
+takes the invoice name from the bill reference (till#invoice), looks up the
+outstanding amounts of all referenced invoices in one query by name and
+allocates each payment the way the Get KCB Payments dialog does. Payments
+whose reference names no submitted, unpaid invoice, or that cannot be
+allocated, stay Unreconciled for someone to handle by hand.
+"""
+
+import frappe
+
+from .diagnostics import record
+
+
+def enqueue_auto_match(names: list[str]) -> None:
+	"""Match the new transactions `names` once the ingesting transaction commits"""
+	if not names or not frappe.get_cached_doc("KCB IPN Settings").auto_match_invoices:
+		return
+
+	frappe.enqueue(
+		"kcb_payments.kcb_payments.utils.auto_match.auto_match_transactions",
+		queue="default",
+		enqueue_after_commit=True,
+		names=names,
+	)
+
+
+def get_matches(names: list[str]) -> list[tuple[str, str]]:
+	"""(transaction, sales invoice) pairs for the Unreconciled transactions in `names` with an unpaid invoice"""
+	from .kcb_payment_notification import get_invoice_from_bill_reference
+
+	transactions = frappe.get_all(
+		"KCB Payment Transaction",
+		filters={"name": ["in", names], "status": "Unreconciled", "docstatus": 1},
+		fields=["name", "bill_reference"],
+		order_by="creation asc",
+	)
+	invoices = {
+		transaction.name: get_invoice_from_bill_reference(transaction.bill_reference or "")
+		for transaction in transactions
+	}
+
+	unpaid = set(
+		frappe.get_all(
+			"Sales Invoice",
+			filters={
+				"name": ["in", list(set(invoices.values()))],
+				"docstatus": 1,
+				"outstanding_amount": [">", 0],
+			},
+			pluck="name",
+		)
+	)
+
+	return [(transaction, invoice) for transaction, invoice in invoices.items() if invoice in unpaid]
+
+
+def auto_match_transactions(names: list[str]) -> None:
+	from .kcb_payment_notification import allocate_kcb_payment
+
+	for transaction, invoice in get_matches(names):
+		frappe.db.savepoint("kcb_auto_match")
+		try:
+			payment_doc = frappe.get_doc("KCB Payment Transaction", transaction, for_update=True)
+			if payment_doc.status != "Unreconciled":
+				# reconciled by hand in the meantime
+				continue
+
+			allocate_kcb_payment(payment_doc, frappe.get_doc("Sales Invoice", invoice))
+		except Exception as e:
+			frappe.db.rollback(save_point="kcb_auto_match")
+			frappe.clear_last_message()
+			record(
+				f"auto_match:error:{type(e).__name__}",
+				"KCB Auto Match Error",
+				f"{transaction} against {invoice}: {e!s}",
+			)
+			continue
+
+		frappe.db.commit()
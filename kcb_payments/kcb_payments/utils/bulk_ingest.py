@@ -0,0 +1,225 @@
+import json
+
+import frappe
+from frappe.model.naming import parse_naming_series
+from frappe.utils import now
+
+from .auto_match import enqueue_auto_match
+from .ipn import extract_fields, get_missing_fields, get_transaction_values
+from .seen_transactions import mark_seen_many
+
+# Columns written by the multi-row insert, besides the standard ones
+TRANSACTION_COLUMNS = (
+	"message_id",
+	"originator_conversation_id",
+	"channel_code",
+	"timestamp",
+	"bill_reference",
+	"mobile_number",
+	"amount",
+	"reconciled",
+	"amount_cents",
+	"remaining_cents",
+	"transaction_date",
+	"transaction_datetime",
+	"kcb_transaction_id",
+	"first_name",
+	"middle_name",
+	"last_name",
+	"currency",
+	"narration",
+	"transaction_type",
+	"balance",
+	"status",
+	"search_mobile",
+	"search_name",
+	"search_receipt",
+)
+
+
+def get_naming_series() -> tuple[str, int]:
+	"""Series and number of digits of the KCB Payment Transaction autoname, e.g. KCB-C2B.-.YY.-.MM.-.#####"""
+	series, digits = frappe.get_meta("KCB Payment Transaction").autoname.rsplit(".", 1)
+	return f"{series}.", len(digits)
+
+
+def reserve_names(count: int) -> list[str]:
+	"""Allocate `count` consecutive KCB Payment Transaction names with a single series update"""
+	naming_series, digits = get_naming_series()
+	prefix = parse_naming_series(naming_series)
+
+	# creates the series row, or advances it even when its current is NULL, and keeps it locked
+	if frappe.db.db_type == "postgres":
+		upsert = """
+			insert into "tabSeries" (name, current) values (%(prefix)s, %(count)s)
+			on conflict (name) do update set current = coalesce("tabSeries".current, 0) + %(count)s
+		"""
+	else:
+		upsert = """
+			insert into `tabSeries` (name, current) values (%(prefix)s, %(count)s)
+			on duplicate key update current = ifnull(current, 0) + %(count)s
+		"""
+	frappe.db.sql(upsert, {"prefix": prefix, "count": count})
+	end = frappe.db.sql("select current from `tabSeries` where name = %s", prefix)[0][0]
+
+	return [f"{prefix}{number:0{digits}d}" for number in range(end - count + 1, end + 1)]
+
+
+def bulk_create_payment_transactions(
+	notifications: list[dict], chunk_size: int = 1000, after_commit: bool = True
+) -> list[frappe._dict]:
+	"""Write many notifications as submitted KCB Payment Transactions using multi-row inserts.
+
+	`notifications` are the field dicts produced by `extract_fields`. The
+	unique index on kcb_transaction_id is still the source of truth for
+	deduplication. Returns one outcome per notification, in input order, with a
+	`status` of Created, Duplicate, Invalid or Error (a row the database
+	refused for another reason, e.g. a name already taken).
+
+	With `after_commit` False the caller registers the follow-up work with
+	`register_after_commit` itself, e.g. only for the outcomes that survive a
+	savepoint rollback.
+	"""
+	outcomes = [
+		frappe._dict(kcb_transaction_id=fields.get("kcb_transaction_id"), status=None, name=None, error=None)
+		for fields in notifications
+	]
+
+	first_seen = {}
+	pending = []
+	for idx, fields in enumerate(notifications):
+		outcome = outcomes[idx]
+		if missing_fields := get_missing_fields(fields):
+			outcome.update(status="Invalid", error=f"Missing: {', '.join(missing_fields)}")
+		elif outcome.kcb_transaction_id in first_seen:
+			outcome.status = "Duplicate"
+		else:
+			first_seen[outcome.kcb_transaction_id] = idx
+			pending.append(idx)
+
+	for start in range(0, len(pending), chunk_size):
+		insert_chunk(notifications, outcomes, pending[start : start + chunk_size])
+
+	# repeats inside the batch point at whichever row won, or share its error
+	for outcome in outcomes:
+		if outcome.status == "Duplicate" and not outcome.name:
+			first = outcomes[first_seen[outcome.kcb_transaction_id]]
+			if first.name:
+				outcome.name = first.name
+			else:
+				outcome.update(status="Error", error=first.error)
+
+	if after_commit:
+		register_after_commit(outcomes)
+
+	return outcomes
+
+
+def register_after_commit(outcomes: list[frappe._dict]) -> None:
+	"""Auto match the created transactions and mark every recorded id seen once the transaction commits"""
+	enqueue_auto_match([outcome.name for outcome in outcomes if outcome.status == "Created"])
+
+	frappe.db.after_commit.add(
+		lambda: mark_seen_many(
+			[(outcome.kcb_transaction_id, outcome.name) for outcome in outcomes if outcome.name]
+		)
+	)
+
+
+def insert_chunk(notifications, outcomes, indexes):
+	from .kcb_payment_notification import get_stk_request_matches
+
+	ids = [outcomes[idx].kcb_transaction_id for idx in indexes]
+
+	existing = dict(
+		frappe.get_all(
+			"KCB Payment Transaction",
+			filters={"kcb_transaction_id": ["in", ids]},
+			fields=["kcb_transaction_id", "name"],
+			as_list=True,
+		)
+	)
+
+	new_indexes = []
+	for idx in indexes:
+		if name := existing.get(outcomes[idx].kcb_transaction_id):
+			outcomes[idx].update(status="Duplicate", name=name)
+		else:
+			new_indexes.append(idx)
+
+	if not new_indexes:
+		return
+
+	stk_matches = get_stk_request_matches(
+		[
+			(notifications[idx].get("originator_conversation_id"), notifications[idx].get("bill_reference"))
+			for idx in new_indexes
+		]
+	)
+
+	names = reserve_names(len(new_indexes))
+	timestamp = now()
+	user = frappe.session.user
+
+	values = []
+	for idx, name in zip(new_indexes, names, strict=True):
+		fields = notifications[idx]
+		row = get_transaction_values(
+			fields, stk_matched=fields.get("originator_conversation_id") in stk_matches
+		)
+		values.append(
+			(name, timestamp, timestamp, user, user, 1, *(row.get(column) for column in TRANSACTION_COLUMNS))
+		)
+		outcomes[idx].name = name
+
+	frappe.db.savepoint("kcb_bulk_insert_chunk")
+	try:
+		insert_rows(values)
+	except frappe.UniqueValidationError:
+		# lost a race with a concurrent insert, or a name is taken: sort it out row by row
+		frappe.db.rollback(save_point="kcb_bulk_insert_chunk")
+		insert_rows_one_by_one(outcomes, new_indexes, values)
+	else:
+		for idx in new_indexes:
+			outcomes[idx].status = "Created"
+
+
+def insert_rows(values: list[tuple]) -> None:
+	frappe.db.bulk_insert(
+		"KCB Payment Transaction",
+		fields=["name", "creation", "modified", "owner", "modified_by", "docstatus", *TRANSACTION_COLUMNS],
+		values=values,
+	)
+
+
+def insert_rows_one_by_one(outcomes, indexes, values) -> None:
+	for idx, row in zip(indexes, values, strict=True):
+		outcome = outcomes[idx]
+		frappe.db.savepoint("kcb_bulk_insert_row")
+		try:
+			insert_rows([row])
+		except frappe.UniqueValidationError as e:
+			frappe.db.rollback(save_point="kcb_bulk_insert_row")
+			if name := frappe.db.get_value(
+				"KCB Payment Transaction", {"kcb_transaction_id": outcome.kcb_transaction_id}
+			):
+				outcome.update(status="Duplicate", name=name)
+			else:
+				# not our id: e.g. a name from a series counter that is behind
+				outcome.update(status="Error", name=None, error=str(e))
+		else:
+			outcome.status = "Created"
+
+
+@frappe.whitelist(methods=["POST"])
+def bulk_ingest_notifications(notifications):
+	"""Backfill raw IPN bodies (a JSON list) in one call and return per-row outcomes"""
+	frappe.only_for("System Manager")
+
+	if isinstance(notifications, str):
+		notifications = json.loads(notifications)
+
+	outcomes = bulk_create_payment_transactions([extract_fields(data or {}) for data in notifications])
+	frappe.db.commit()
+
+	return outcomes
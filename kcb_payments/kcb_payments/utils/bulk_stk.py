@@ -0,0 +1,269 @@
+"""STK pushes for many invoices at once, e.g. a collection campaign.
+
+A campaign runs as a background job on the long queue. The KCB Mpesa STK
+Requests are created and committed first, each tagged with the job's bulk
+push id, then a fixed number of threads, each with its own database
+connection, send the pushes. They wait for the till's rate limit rather
+than being marked Throttled. Progress is read back from the tagged STK
+requests with `get_bulk_stk_push_status`.
+"""
+
+import json
+import queue
+import threading
+import time
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+
+from .stk_dispatch import dispatch_stk_push
+from .utils import sanitize_mobile_number
+
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+# a campaign waits its turn at the till's rate limit instead of being throttled
+BULK_MAX_WAIT = 60
+
+# skipped items and the timings of a queued campaign, kept for the status endpoint
+RESULT_TTL = 24 * 60 * 60
+
+# reference doctype -> (amount field, phone field)
+REFERENCE_FIELDS = {
+	"Sales Invoice": ("outstanding_amount", "contact_mobile"),
+	"Payment Request": ("outstanding_amount", "phone_number"),
+}
+REFERENCE_FILTERS = {
+	"Payment Request": {"status": ["!=", "Paid"]},
+}
+
+
+def get_references(items: list[dict]) -> dict[tuple[str, str], frappe._dict]:
+	"""Amount and phone of every referenced document, one query per doctype"""
+	references = {}
+	for doctype, (amount_field, phone_field) in REFERENCE_FIELDS.items():
+		names = [item.get("reference_name") for item in items if item.get("reference_doctype") == doctype]
+		if not names:
+			continue
+
+		for row in frappe.get_all(
+			doctype,
+			filters={"name": ["in", names], "docstatus": 1, **REFERENCE_FILTERS.get(doctype, {})},
+			fields=["name", f"{amount_field} as amount", f"{phone_field} as phone_number"],
+		):
+			references[(doctype, row.name)] = row
+
+	return references
+
+
+def create_stk_requests(settings, items: list[dict], bulk_push_id: str | None = None) -> list[frappe._dict]:
+	"""Submit one Queued KCB Mpesa STK Request per item, returning a result per item"""
+	references = get_references(items)
+	results = []
+
+	for item in items:
+		item = frappe._dict(item)
+		result = frappe._dict(
+			reference_doctype=item.reference_doctype,
+			reference_name=item.reference_name,
+			stk_request=None,
+			status=None,
+			error=None,
+		)
+		results.append(result)
+
+		reference = references.get((item.reference_doctype, item.reference_name))
+		if not reference:
+			result.update(
+				status="Skipped", error=_("Not a submitted, unpaid Sales Invoice or Payment Request")
+			)
+			continue
+
+		amount = flt(item.amount or reference.amount)
+		if amount <= 0:
+			result.update(status="Skipped", error=_("Nothing outstanding"))
+			continue
+
+		frappe.db.savepoint("kcb_bulk_stk_request")
+		try:
+			phone_number = sanitize_mobile_number(item.phone_number or reference.phone_number or "")
+			stk_request = frappe.get_doc(
+				{
+					"doctype": "KCB Mpesa STK Request",
+					"amount": amount,
+					"phone_number": phone_number,
+					"timestamp": frappe.utils.now(),
+					"kcb_mpesa_settings": settings.name,
+					"payment_gateway": "KCB Mpesa-" + settings.payment_gateway_name,
+					"reference_doctype": item.reference_doctype,
+					"reference_name": item.reference_name,
+					"bulk_push_id": bulk_push_id,
+				}
+			)
+			# sent by the bulk workers below, not by on_submit
+			stk_request.flags.defer_stk_push = True
+			stk_request.insert(ignore_permissions=True)
+			stk_request.submit()
+		except Exception as e:
+			frappe.db.rollback(save_point="kcb_bulk_stk_request")
+			frappe.clear_last_message()
+			result.update(status="Skipped", error=str(e))
+			continue
+
+		result.update(stk_request=stk_request.name, status="Queued")
+
+	frappe.db.commit()
+	return results
+
+
+def send_pushes(results: list[frappe._dict], concurrency: int) -> None:
+	"""Dispatch the Queued requests of `results` from `concurrency` threads"""
+	pending = queue.Queue()
+	for result in results:
+		if result.status == "Queued":
+			pending.put(result)
+
+	site = frappe.local.site
+	sites_path = frappe.local.sites_path
+	user = frappe.session.user
+
+	def worker():
+		frappe.init(site=site, sites_path=sites_path)
+		try:
+			frappe.connect()
+			frappe.set_user(user)
+			frappe.flags.kcb_rate_limit_max_wait = BULK_MAX_WAIT
+			while True:
+				try:
+					result = pending.get_nowait()
+				except queue.Empty:
+					return
+
+				try:
+					dispatch_stk_push(result.stk_request)
+					result.update(
+						frappe.db.get_value(
+							"KCB Mpesa STK Request",
+							result.stk_request,
+							["status", "error_message as error"],
+							as_dict=True,
+						)
+					)
+				except Exception as e:
+					frappe.db.rollback()
+					result.update(status="Failed", error=str(e))
+		finally:
+			frappe.destroy()
+
+	threads = [threading.Thread(target=worker) for _ in range(min(concurrency, pending.qsize()))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+
+def bulk_stk_push(
+	settings: str,
+	items: list[dict],
+	concurrency: int = DEFAULT_CONCURRENCY,
+	bulk_push_id: str | None = None,
+) -> frappe._dict:
+	"""Send STK pushes for `items`, each {"reference_doctype", "reference_name"} with an
+	optional "phone_number" and "amount" overriding the ones on the document.
+	"""
+	settings = frappe.get_doc("KCB Mpesa Settings", settings)
+	concurrency = max(1, min(int(concurrency or DEFAULT_CONCURRENCY), MAX_CONCURRENCY))
+
+	started = time.monotonic()
+	results = create_stk_requests(settings, items, bulk_push_id)
+	if bulk_push_id:
+		frappe.cache.set_value(
+			get_skipped_key(bulk_push_id),
+			[result for result in results if result.status == "Skipped"],
+			expires_in_sec=RESULT_TTL,
+		)
+	send_pushes(results, concurrency)
+	elapsed = time.monotonic() - started
+
+	timings = frappe._dict(
+		elapsed=round(elapsed, 3),
+		throughput=round(len(results) / elapsed, 2) if elapsed else 0,
+	)
+	if bulk_push_id:
+		frappe.cache.set_value(get_timings_key(bulk_push_id), timings, expires_in_sec=RESULT_TTL)
+
+	return frappe._dict(results=results, summary=summarize(results), **timings)
+
+
+def summarize(results: list[frappe._dict]) -> dict[str, int]:
+	"""Number of results per status"""
+	summary = {}
+	for result in results:
+		summary[result.status] = summary.get(result.status, 0) + 1
+	return summary
+
+
+def get_skipped_key(bulk_push_id: str) -> str:
+	return f"{bulk_push_id}:skipped"
+
+
+def get_timings_key(bulk_push_id: str) -> str:
+	return f"{bulk_push_id}:timings"
+
+
+@frappe.whitelist(methods=["POST"])
+def send_bulk_stk_push(settings, items, concurrency=DEFAULT_CONCURRENCY):
+	"""Queue STK pushes for a JSON list of references and return the job id, which is also the bulk push id"""
+	frappe.only_for(["System Manager", "Accounts Manager"])
+
+	if isinstance(items, str):
+		items = json.loads(items)
+
+	if not frappe.db.exists("KCB Mpesa Settings", settings):
+		frappe.throw(_("KCB Mpesa Settings {0} not found").format(settings))
+
+	bulk_push_id = f"kcb_bulk_stk_push:{frappe.generate_hash(length=12)}"
+	frappe.enqueue(
+		"kcb_payments.kcb_payments.utils.bulk_stk.bulk_stk_push",
+		queue="long",
+		job_id=bulk_push_id,
+		enqueue_after_commit=True,
+		settings=settings,
+		items=items,
+		concurrency=concurrency,
+		bulk_push_id=bulk_push_id,
+	)
+
+	return bulk_push_id
+
+
+@frappe.whitelist()
+def get_bulk_stk_push_status(bulk_push_id: str) -> frappe._dict:
+	"""Per-item results of a queued bulk push, read from its STK requests.
+
+	`elapsed` and `throughput` are set once the job has sent every push, and are None until then.
+	"""
+	frappe.only_for(["System Manager", "Accounts Manager"])
+
+	results = frappe.get_all(
+		"KCB Mpesa STK Request",
+		filters={"bulk_push_id": bulk_push_id},
+		fields=[
+			"reference_doctype",
+			"reference_name",
+			"name as stk_request",
+			"status",
+			"error_message as error",
+		],
+		order_by="creation asc",
+	)
+	results += frappe.cache.get_value(get_skipped_key(bulk_push_id)) or []
+
+	timings = frappe.cache.get_value(get_timings_key(bulk_push_id)) or {}
+
+	return frappe._dict(
+		results=results,
+		summary=summarize(results),
+		elapsed=timings.get("elapsed"),
+		throughput=timings.get("throughput"),
+	)
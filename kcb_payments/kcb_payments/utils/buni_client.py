@@ -0,0 +1,130 @@
+"""Pooled HTTP client for the KCB Buni API.
+
+Each worker process keeps one keep-alive `requests.Session` per base URL, so
+consecutive token and STK push calls reuse the TCP/TLS connection instead of
+handshaking every time. Retries follow what is safe to repeat: the token
+request has no side effects and is retried on connect, read and gateway
+errors, while an STK push is only retried when the connection could not be
+established, because a push that reached KCB would prompt the customer twice.
+"""
+
+import os
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .circuit_breaker import get_breaker
+
+SANDBOX_URL = "https://uat.buni.kcbgroup.com"
+PRODUCTION_URL = "https://api.buni.kcbgroup.com"
+
+TOKEN_PATH = "/token"
+STK_PUSH_PATH = "/mm/api/request/1.0.0/stkpush"
+
+# path -> circuit breaker name
+ENDPOINTS = {TOKEN_PATH: "token", STK_PUSH_PATH: "stkpush"}
+
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_POOL_SIZE = 10
+
+_lock = threading.Lock()
+_sessions: dict[tuple[int, str], requests.Session] = {}
+
+
+def get_base_url(sandbox: bool) -> str:
+	return SANDBOX_URL if sandbox else PRODUCTION_URL
+
+
+def get_timeout() -> tuple[float, float]:
+	return (
+		frappe.conf.get("kcb_http_connect_timeout") or DEFAULT_CONNECT_TIMEOUT,
+		frappe.conf.get("kcb_http_read_timeout") or DEFAULT_READ_TIMEOUT,
+	)
+
+
+def token_retry() -> Retry:
+	return Retry(
+		total=3,
+		connect=3,
+		read=2,
+		status=2,
+		other=0,
+		status_forcelist=(502, 503, 504),
+		allowed_methods=frozenset({"POST"}),
+		backoff_factor=0.2,
+		raise_on_status=False,
+	)
+
+
+def stk_push_retry() -> Retry:
+	return Retry(
+		total=2,
+		connect=2,
+		read=0,
+		status=0,
+		other=0,
+		allowed_methods=frozenset({"POST"}),
+		backoff_factor=0.2,
+		raise_on_status=False,
+	)
+
+
+def make_session(base_url: str, pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+	session = requests.Session()
+	# the session is shared by every till of the process, never carry cookies between them
+	session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+	# requests picks the adapter with the longest matching prefix; each keeps its own pool
+	session.mount(
+		base_url + TOKEN_PATH,
+		HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=token_retry()),
+	)
+	session.mount(
+		base_url,
+		HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=stk_push_retry()),
+	)
+	return session
+
+
+def get_session(base_url: str) -> requests.Session:
+	"""The keep-alive session for `base_url` in this process"""
+	# sessions must not cross a fork, their sockets would be shared with the parent
+	key = (os.getpid(), base_url)
+	if session := _sessions.get(key):
+		return session
+
+	with _lock:
+		if key not in _sessions:
+			_sessions[key] = make_session(
+				base_url, frappe.conf.get("kcb_http_pool_size") or DEFAULT_POOL_SIZE
+			)
+		return _sessions[key]
+
+
+def post(sandbox: bool, path: str, **kwargs) -> requests.Response:
+	"""POST to a Buni endpoint through the pooled session with the configured timeouts.
+
+	Raises CircuitOpenError without calling Buni while the endpoint's breaker is open.
+	"""
+	base_url = get_base_url(sandbox)
+	kwargs.setdefault("timeout", get_timeout())
+
+	breaker = get_breaker(sandbox, ENDPOINTS[path])
+	probe = breaker.before_call()
+
+	try:
+		response = get_session(base_url).post(base_url + path, **kwargs)
+	except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+		breaker.record_failure(probe)
+		raise
+
+	if response.status_code >= 500:
+		breaker.record_failure(probe)
+	else:
+		breaker.record_success(probe)
+
+	return response
@@ -0,0 +1,118 @@
+"""Circuit breakers for the Buni endpoints, shared by all workers through Redis.
+
+A breaker is kept per endpoint and environment (sandbox or production).
+Timeouts, connection errors and 5xx responses are counted over a window
+starting with the first failure. Once they reach the threshold the breaker
+opens, and calls fail at
+once with CircuitOpenError instead of tying up a worker for the full
+timeout. When the open period ends a single call is let through as a probe:
+its success closes the breaker, its failure opens it again.
+
+Commands go through pipelines so they reach Redis as-is. Redis keys per
+breaker:
+	<prefix>:failures  failures in the current window (expires with it)
+	<prefix>:open      present while open (expires after the open period)
+	<prefix>:tripped   present from opening until a probe succeeds
+	<prefix>:probe     held by the caller probing a half-open breaker
+"""
+
+import frappe
+
+KEY_PREFIX = "kcb_circuit:"
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_WINDOW = 60
+DEFAULT_OPEN_SECONDS = 30
+# longer than a probe can take with its timeouts and retries
+PROBE_TIMEOUT = 60
+
+CLOSED = "Closed"
+OPEN = "Open"
+HALF_OPEN = "Half Open"
+
+
+class CircuitOpenError(Exception):
+	"""Buni is considered unavailable, the call was not made"""
+
+
+class CircuitBreaker:
+	def __init__(self, name: str):
+		self.name = name
+		self.prefix = frappe.cache.make_key(KEY_PREFIX + name)
+
+	def key(self, suffix: str) -> str:
+		return f"{self.prefix}:{suffix}"
+
+	def get_state(self) -> str:
+		pipeline = frappe.cache.pipeline()
+		pipeline.exists(self.key("open"))
+		pipeline.exists(self.key("tripped"))
+		is_open, tripped = pipeline.execute()
+
+		if is_open:
+			return OPEN
+		return HALF_OPEN if tripped else CLOSED
+
+	def before_call(self) -> bool:
+		"""Raise CircuitOpenError unless the call may go ahead; True when it is the half-open probe"""
+		state = self.get_state()
+		if state == CLOSED:
+			return False
+
+		# only one caller probes, the rest keep failing fast until it reports back
+		if state == HALF_OPEN:
+			if frappe.cache.pipeline().set(self.key("probe"), 1, nx=True, ex=PROBE_TIMEOUT).execute()[0]:
+				return True
+
+		raise CircuitOpenError(f"KCB {self.name} is unavailable, retry shortly")
+
+	def record_success(self, probe: bool = False) -> None:
+		# a success does not reset the window, sporadic errors between successes still add up
+		if probe:
+			self.reset()
+
+	def record_failure(self, probe: bool = False) -> None:
+		if probe:
+			self.trip()
+			return
+
+		failures = frappe.cache.pipeline().incr(self.key("failures")).execute()[0]
+		if failures == 1:
+			# the window starts with its first failure
+			frappe.cache.pipeline().expire(
+				self.key("failures"), get_config("kcb_circuit_window", DEFAULT_WINDOW)
+			).execute()
+
+		if failures >= get_config("kcb_circuit_failure_threshold", DEFAULT_FAILURE_THRESHOLD):
+			self.trip()
+
+	def trip(self) -> None:
+		open_seconds = get_config("kcb_circuit_open_seconds", DEFAULT_OPEN_SECONDS)
+
+		pipeline = frappe.cache.pipeline()
+		pipeline.set(self.key("open"), 1, ex=open_seconds)
+		pipeline.set(self.key("tripped"), 1)
+		pipeline.delete(self.key("failures"), self.key("probe"))
+		pipeline.execute()
+
+	def reset(self) -> None:
+		frappe.cache.pipeline().delete(
+			self.key("failures"), self.key("open"), self.key("tripped"), self.key("probe")
+		).execute()
+
+
+def get_config(key: str, default: int) -> int:
+	return frappe.conf.get(key) or default
+
+
+def get_breaker(sandbox: bool, endpoint: str) -> CircuitBreaker:
+	return CircuitBreaker(f"{'sandbox' if sandbox else 'production'}:{endpoint}")
+
+
+@frappe.whitelist()
+def get_circuit_states(sandbox: bool = False) -> dict:
+	"""State of the token and STK push breakers, for the settings form"""
+	frappe.has_permission("KCB Mpesa Settings", throw=True)
+
+	sandbox = frappe.utils.sbool(sandbox)
+	return {endpoint: get_breaker(sandbox, endpoint).get_state() for endpoint in ("token", "stkpush")}
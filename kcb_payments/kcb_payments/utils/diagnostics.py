@@ -0,0 +1,68 @@
+"""Aggregated diagnostics for the KCB hot paths.
+
+`record` costs one Redis round trip instead of an Error Log insert inside
+the request. Occurrences are counted per key and one sample message is kept
+per key; `flush_diagnostics` periodically turns each key into a single Error
+Log entry carrying the count.
+"""
+
+import random
+
+import frappe
+
+COUNTS_KEY = "kcb_diagnostics_counts"
+TITLES_KEY = "kcb_diagnostics_titles"
+SAMPLES_KEY = "kcb_diagnostics_samples"
+
+# after the first message of a window, replace the sample with probability 1/SAMPLE_RATE
+SAMPLE_RATE = 100
+
+
+def record(key: str, title: str, message: str = "") -> None:
+	"""Count one occurrence of `key` for the next flush to Error Log"""
+	try:
+		pipeline = frappe.cache.pipeline()
+		pipeline.hincrby(frappe.cache.make_key(COUNTS_KEY), key, 1)
+		pipeline.hsetnx(frappe.cache.make_key(TITLES_KEY), key, title)
+		if random.randrange(SAMPLE_RATE) == 0:
+			pipeline.hset(frappe.cache.make_key(SAMPLES_KEY), key, message)
+		else:
+			pipeline.hsetnx(frappe.cache.make_key(SAMPLES_KEY), key, message)
+		pipeline.execute()
+	except Exception:
+		# diagnostics must never break a payment, fall back to the regular log
+		frappe.log_error(title=title, message=message)
+
+
+def flush_diagnostics() -> None:
+	"""Write one Error Log per key recorded since the last flush"""
+	suffix = frappe.generate_hash(length=8)
+	keys = [frappe.cache.make_key(key) for key in (COUNTS_KEY, TITLES_KEY, SAMPLES_KEY)]
+
+	# move the hashes aside atomically so records made during the flush go to the next window
+	pipeline = frappe.cache.pipeline()
+	for key in keys:
+		pipeline.exists(key)
+	if not all(pipeline.execute()):
+		return
+
+	pipeline = frappe.cache.pipeline(transaction=True)
+	for key in keys:
+		pipeline.rename(key, f"{key}:{suffix}")
+	pipeline.execute()
+
+	pipeline = frappe.cache.pipeline()
+	for key in keys:
+		pipeline.hgetall(f"{key}:{suffix}")
+		pipeline.delete(f"{key}:{suffix}")
+	counts, _, titles, _, samples, _ = pipeline.execute()
+
+	for key, count in counts.items():
+		title = (titles.get(key) or key).decode()
+		sample = (samples.get(key) or b"").decode()
+		frappe.log_error(
+			title=f"{title} (x{int(count)})" if int(count) > 1 else title,
+			message=f"Key: {key.decode()}\nOccurrences: {int(count)}\n\nSample:\n{sample}",
+		)
+
+	frappe.db.commit()
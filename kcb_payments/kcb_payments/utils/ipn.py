@@ -0,0 +1,146 @@
+import json
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from zoneinfo import ZoneInfo
+
+import frappe
+from frappe.utils import get_system_timezone
+
+from .transaction_search import get_search_values
+
+# KCB Payment Transaction field -> key in requestPayload.additionalData.notificationData
+NOTIFICATION_FIELDS = {
+	"bill_reference": "businessKey",
+	"mobile_number": "debitMSISDN",
+	"amount": "transactionAmt",
+	"transaction_date": "transactionDate",
+	"kcb_transaction_id": "transactionID",
+	"first_name": "firstName",
+	"middle_name": "middleName",
+	"last_name": "lastName",
+	"currency": "currency",
+	"narration": "narration",
+	"transaction_type": "transactionType",
+	"balance": "balance",
+}
+
+# KCB Payment Transaction field -> key in header
+HEADER_FIELDS = {
+	"message_id": "messageID",
+	"originator_conversation_id": "originatorConversationID",
+	"channel_code": "channelCode",
+	"timestamp": "timeStamp",
+}
+
+OPTIONAL_TEXT_FIELDS = (
+	"originator_conversation_id",
+	"middle_name",
+	"last_name",
+	"narration",
+	"transaction_type",
+)
+
+
+def canonicalize(data) -> bytes:
+	"""The exact bytes KCB signs: compact JSON with ASCII escapes"""
+	return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def extract_fields(data: dict) -> frappe._dict:
+	"""Map the header/notificationData of a decoded IPN to KCB Payment Transaction fields"""
+	header = data.get("header") or {}
+	request_payload = data.get("requestPayload") or {}
+	notification_data = (request_payload.get("additionalData") or {}).get("notificationData") or {}
+
+	fields = frappe._dict()
+	for fieldname, key in HEADER_FIELDS.items():
+		fields[fieldname] = header.get(key)
+	for fieldname, key in NOTIFICATION_FIELDS.items():
+		fields[fieldname] = notification_data.get(key)
+	for fieldname in OPTIONAL_TEXT_FIELDS:
+		fields[fieldname] = fields[fieldname] or ""
+
+	return fields
+
+
+def parse_notification(raw: bytes | str | None) -> frappe._dict:
+	"""Parse an IPN body once.
+
+	Returns the decoded payload, the canonical bytes used for signature
+	verification and the header/notificationData values mapped to
+	KCB Payment Transaction fields.
+	"""
+	data = json.loads(raw) if raw else None
+	if not isinstance(data, dict):
+		data = {}
+
+	return frappe._dict(
+		data=data,
+		signing_bytes=canonicalize(data) if data else b"",
+		fields=extract_fields(data),
+	)
+
+
+def get_transaction_values(fields: dict, stk_matched: bool = False) -> dict:
+	"""KCB Payment Transaction values for a notification, including its initial reconciliation status.
+
+	A notification is reconciled on arrival when it matches a completed STK
+	request or its bill reference points at a Payment Request.
+	"""
+	should_reconcile = stk_matched or "#ACC-PRQ-" in (fields.get("bill_reference") or "")
+	amount = frappe.utils.flt(fields.get("amount"), 2)
+	reconciled = amount if should_reconcile else 0
+	balance = fields.get("balance")
+
+	return {
+		**fields,
+		"amount": amount,
+		"reconciled": reconciled,
+		**get_cents_values(amount, reconciled),
+		"balance": frappe.utils.flt(balance, 2) if balance else 0.0,
+		"status": "Reconciled" if should_reconcile else "Unreconciled",
+		"transaction_datetime": parse_transaction_datetime(fields),
+		**get_search_values(fields),
+	}
+
+
+def to_cents(amount) -> int:
+	"""`amount` in whole cents, rounded half up"""
+	return int((Decimal(str(amount or 0)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+
+def get_cents_values(amount, reconciled) -> dict:
+	"""amount_cents and remaining_cents, the exact integer copies of amount and amount - reconciled"""
+	amount_cents = to_cents(amount)
+	return {"amount_cents": amount_cents, "remaining_cents": max(amount_cents - to_cents(reconciled), 0)}
+
+
+def parse_transaction_datetime(fields: dict) -> datetime | None:
+	"""When the payment happened, from transactionDate (yyyyMMddHHmmss) or else the header timeStamp (ISO).
+
+	Naive values are KCB's local time, like the site's; offsets are converted
+	to the system timezone.
+	"""
+	for value in (fields.get("transaction_date"), fields.get("timestamp")):
+		value = str(value or "").strip()
+		if not value:
+			continue
+
+		try:
+			if len(value) == 14 and value.isdigit():
+				return datetime.strptime(value, "%Y%m%d%H%M%S")
+
+			parsed = datetime.fromisoformat(value)
+		except ValueError:
+			continue
+
+		if parsed.tzinfo:
+			parsed = parsed.astimezone(ZoneInfo(get_system_timezone())).replace(tzinfo=None)
+		return parsed
+
+	return None
+
+
+def get_missing_fields(fields: dict) -> list[str]:
+	required = ("message_id", "bill_reference", "mobile_number", "amount", "kcb_transaction_id")
+	return [fieldname for fieldname in required if not fields.get(fieldname)]
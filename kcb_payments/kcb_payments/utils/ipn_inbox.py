@@ -0,0 +1,173 @@
+import frappe
+from frappe.utils import add_to_date, now
+from pypika.terms import Case
+
+from .bulk_ingest import bulk_create_payment_transactions, register_after_commit
+from .ipn import parse_notification
+
+STALE_CLAIM_MINUTES = 15
+RETRY_DELAY_SECONDS = 60
+
+
+def append_to_inbox(raw_payload: bytes | str, fields: frappe._dict) -> str:
+	"""Store a verified notification for background processing and return the inbox entry name"""
+	if isinstance(raw_payload, bytes):
+		raw_payload = raw_payload.decode("utf-8")
+
+	entry = frappe.get_doc(
+		{
+			"doctype": "KCB IPN Inbox",
+			"kcb_transaction_id": fields.kcb_transaction_id,
+			"message_id": fields.message_id,
+			"payload": raw_payload,
+			"status": "Pending",
+		}
+	)
+	entry.insert(ignore_permissions=True)
+	enqueue_inbox_drain()
+
+	return entry.name
+
+
+def enqueue_inbox_drain() -> None:
+	frappe.enqueue(
+		"kcb_payments.kcb_payments.utils.ipn_inbox.process_ipn_inbox",
+		queue="short",
+		job_id="kcb_ipn_inbox",
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def claim_batch(batch_size: int) -> list[str]:
+	"""Mark up to `batch_size` waiting entries as Processing and return their names.
+
+	Rows are locked with SKIP LOCKED so several workers can drain the inbox
+	without picking the same notification. Failed entries wait
+	RETRY_DELAY_SECONDS before they are picked up again.
+	"""
+	names = frappe.db.sql(
+		"""
+		select name
+		from `tabKCB IPN Inbox`
+		where status = 'Pending'
+			or (status = 'Failed' and modified < %(retry_before)s)
+		order by creation
+		limit %(batch_size)s
+		for update skip locked
+		""",
+		{
+			"retry_before": add_to_date(now(), seconds=-RETRY_DELAY_SECONDS),
+			"batch_size": batch_size,
+		},
+		pluck=True,
+	)
+
+	if names:
+		frappe.db.set_value("KCB IPN Inbox", {"name": ["in", names]}, "status", "Processing")
+
+	frappe.db.commit()
+	return names
+
+
+def release_stale_claims(max_retries: int) -> None:
+	"""Return entries left in Processing by a worker that died to the queue, counting it as a failed attempt"""
+	inbox = frappe.qb.DocType("KCB IPN Inbox")
+	(
+		frappe.qb.update(inbox)
+		.set(inbox.status, Case().when(inbox.retry_count + 1 >= max_retries, "Poisoned").else_("Failed"))
+		.set(inbox.retry_count, inbox.retry_count + 1)
+		.set(inbox.modified, now())
+		.where(inbox.status == "Processing")
+		.where(inbox.modified < add_to_date(now(), minutes=-STALE_CLAIM_MINUTES))
+	).run()
+	frappe.db.commit()
+
+
+def process_ipn_inbox(batch_size: int | None = None) -> None:
+	settings = frappe.get_cached_doc("KCB IPN Settings")
+	batch_size = batch_size or settings.inbox_batch_size or 200
+	max_retries = settings.inbox_max_retries or 5
+
+	release_stale_claims(max_retries)
+
+	while names := claim_batch(batch_size):
+		entries = frappe.get_all(
+			"KCB IPN Inbox",
+			filters={"name": ["in", names]},
+			fields=["name", "payload", "retry_count"],
+			order_by="creation asc",
+		)
+
+		# a savepoint rollback leaves after_commit callbacks in place, so they are only
+		# registered for the outcomes that are about to be committed
+		outcomes = []
+		try:
+			outcomes = process_entries(entries)
+		except Exception:
+			frappe.db.rollback()
+
+			# isolate the entry that broke the batch so the rest still go through
+			for entry in entries:
+				frappe.db.savepoint("kcb_ipn_inbox_entry")
+				try:
+					outcomes += process_entries([entry])
+				except Exception:
+					frappe.db.rollback(save_point="kcb_ipn_inbox_entry")
+					mark_failed(entry, max_retries, frappe.get_traceback())
+
+		register_after_commit(outcomes)
+		frappe.db.commit()
+
+
+def process_entries(entries: list[dict]) -> list[frappe._dict]:
+	notifications = []
+	for entry in entries:
+		try:
+			notifications.append(parse_notification(entry.payload).fields)
+		except ValueError as e:
+			entry.parse_error = f"Invalid JSON: {e!s}"
+			notifications.append(frappe._dict())
+
+	outcomes = bulk_create_payment_transactions(notifications, after_commit=False)
+	processed_at = now()
+
+	for entry, outcome in zip(entries, outcomes, strict=True):
+		if outcome.status == "Error":
+			# the row was refused, so nothing was recorded; fail the batch and retry the entry on its own
+			raise frappe.ValidationError(f"{entry.name}: {outcome.error}")
+
+		if outcome.status == "Invalid":
+			# will never succeed, no point retrying
+			values = {"status": "Poisoned", "last_error": entry.get("parse_error") or outcome.error}
+		else:
+			values = {
+				"status": "Processed" if outcome.status == "Created" else "Duplicate",
+				"payment_transaction": outcome.name,
+				"processed_at": processed_at,
+			}
+
+		frappe.db.set_value("KCB IPN Inbox", entry.name, values)
+
+	return outcomes
+
+
+def mark_failed(entry: dict, max_retries: int, error: str) -> None:
+	retry_count = entry.retry_count + 1
+	frappe.db.set_value(
+		"KCB IPN Inbox",
+		entry.name,
+		{
+			"status": "Poisoned" if retry_count >= max_retries else "Failed",
+			"retry_count": retry_count,
+			"last_error": error,
+		},
+	)
+
+
+@frappe.whitelist()
+def requeue_inbox_entry(name: str) -> None:
+	frappe.only_for("System Manager")
+
+	frappe.db.set_value("KCB IPN Inbox", name, {"status": "Pending", "retry_count": 0})
+	enqueue_inbox_drain()
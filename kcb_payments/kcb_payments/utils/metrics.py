@@ -0,0 +1,202 @@
+"""Latency histograms for the KCB endpoints and the outbound Buni calls.
+
+Observations are buffered per worker process and added to a Redis hash at
+most every FLUSH_INTERVAL seconds, so recording one costs no I/O. The hash
+holds cumulative totals for every worker and is rendered in the Prometheus
+text format by the `metrics` endpoint.
+"""
+
+import functools
+import hmac
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import frappe
+from werkzeug.wrappers import Response
+
+METRICS_KEY = "kcb_metrics"
+METRIC_NAME = "kcb_request_duration_seconds"
+
+# upper bounds in seconds, the last bucket is +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+FLUSH_INTERVAL = 5
+
+# anything else in a businessKey is not used as a label, so callers cannot mint new series at will
+TILL_PATTERN = re.compile(r"\d{1,10}")
+
+_lock = threading.Lock()
+_pending: dict[str, float] = {}
+_last_flush = time.monotonic()
+
+
+def get_till(bill_reference: str | None) -> str:
+	"""Till number from an IPN businessKey such as 7504343#ACC-SINV-2026-00780, or "" if it is not one"""
+	till = (bill_reference or "").split("#", 1)[0].strip()
+	return till if TILL_PATTERN.fullmatch(till) else ""
+
+
+def observe(operation: str, seconds: float, outcome: str, till: str = "") -> None:
+	"""Buffer one observation of `operation`"""
+	series = "|".join((operation, outcome or "unknown", str(till or "").replace("|", "")))
+
+	with _lock:
+		for idx, bound in enumerate(BUCKETS):
+			if seconds <= bound:
+				field = f"{series}|{idx}"
+				_pending[field] = _pending.get(field, 0) + 1
+		for suffix, value in (("inf", 1), ("count", 1), ("sum", seconds)):
+			field = f"{series}|{suffix}"
+			_pending[field] = _pending.get(field, 0) + value
+
+	flush_if_due()
+
+
+def flush_if_due() -> None:
+	if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+		flush()
+
+
+def flush() -> None:
+	"""Add the buffered observations of this process to the shared totals"""
+	global _last_flush
+
+	with _lock:
+		pending = dict(_pending)
+		_pending.clear()
+		_last_flush = time.monotonic()
+
+	if not pending:
+		return
+
+	try:
+		key = frappe.cache.make_key(METRICS_KEY)
+		pipeline = frappe.cache.pipeline()
+		for field, value in pending.items():
+			if field.endswith("|sum"):
+				pipeline.hincrbyfloat(key, field, value)
+			else:
+				pipeline.hincrby(key, field, int(value))
+		pipeline.execute()
+	except Exception:
+		# metrics are best effort, a lost window must not fail the request
+		pass
+
+
+@contextmanager
+def track(operation: str, till: str = ""):
+	"""Time the block and record it under `operation`.
+
+	Yields a dict whose `outcome` and `till` can be set inside the block. The
+	outcome defaults to "success", or "error" when the block raises.
+	"""
+	labels = frappe._dict(outcome="success", till=till)
+	started = time.perf_counter()
+	try:
+		yield labels
+	except Exception:
+		labels.outcome = "error"
+		raise
+	finally:
+		observe(operation, time.perf_counter() - started, labels.outcome, labels.till)
+
+
+def instrument(operation: str, get_outcome=None):
+	"""Decorator timing every call of an endpoint.
+
+	`get_outcome(result)` maps the return value to an outcome label. The
+	endpoint can name the till it served with `set_till`.
+	"""
+
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			with track(operation) as labels:
+				if not hasattr(frappe.local, "kcb_metric_labels"):
+					frappe.local.kcb_metric_labels = []
+				stack = frappe.local.kcb_metric_labels
+				stack.append(labels)
+				try:
+					result = fn(*args, **kwargs)
+				finally:
+					stack.pop()
+
+				if get_outcome:
+					labels.outcome = get_outcome(result)
+				return result
+
+		return wrapper
+
+	return decorator
+
+
+def set_till(till: str | None) -> None:
+	"""Label the endpoint call in progress with the till it served"""
+	if stack := getattr(frappe.local, "kcb_metric_labels", None):
+		stack[-1].till = till or ""
+
+
+def escape_label(value: str) -> str:
+	return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+	"""Current totals in the Prometheus text exposition format"""
+	totals = frappe.cache.pipeline().hgetall(frappe.cache.make_key(METRICS_KEY)).execute()[0]
+
+	series = {}
+	for field, value in totals.items():
+		operation, outcome, till, suffix = field.decode().split("|")
+		series.setdefault((operation, outcome, till), {})[suffix] = value.decode()
+
+	lines = [
+		f"# HELP {METRIC_NAME} Duration of KCB endpoint calls and outbound Buni requests.",
+		f"# TYPE {METRIC_NAME} histogram",
+	]
+	for (operation, outcome, till), values in sorted(series.items()):
+		labels = ",".join(
+			f'{name}="{escape_label(value)}"'
+			for name, value in (("operation", operation), ("outcome", outcome), ("till", till))
+		)
+
+		# observe adds to every bucket at or above the duration, so the stored values are cumulative
+		for idx, bound in enumerate(BUCKETS):
+			lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound}"}} {values.get(str(idx), 0)}')
+		lines.append(f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {values.get("inf", 0)}')
+		lines.append(f"{METRIC_NAME}_sum{{{labels}}} {values.get('sum', 0)}")
+		lines.append(f"{METRIC_NAME}_count{{{labels}}} {values.get('count', 0)}")
+
+	return "\n".join(lines) + "\n"
+
+
+def authorize(token: str | None) -> None:
+	"""Allow scrapers passing `kcb_metrics_token` from site config, or a System Manager"""
+	expected = frappe.conf.get("kcb_metrics_token")
+	token = token or frappe.get_request_header("X-Metrics-Token")
+
+	if expected and token and hmac.compare_digest(token, expected):
+		return
+
+	frappe.only_for("System Manager")
+
+
+def render_queue_depth() -> str:
+	from .stk_dispatch import get_queue_depth
+
+	depth = get_queue_depth()
+	return (
+		"# HELP kcb_stk_queue_jobs STK push jobs on the dispatch queue.\n"
+		"# TYPE kcb_stk_queue_jobs gauge\n"
+		f'kcb_stk_queue_jobs{{queue="{depth.queue}",state="queued"}} {depth.queued}\n'
+		f'kcb_stk_queue_jobs{{queue="{depth.queue}",state="started"}} {depth.started}\n'
+	)
+
+
+@frappe.whitelist(allow_guest=True, methods=["GET"])
+def metrics(token: str | None = None):
+	authorize(token)
+	flush()
+
+	return Response(render() + render_queue_depth(), mimetype="text/plain; version=0.0.4")
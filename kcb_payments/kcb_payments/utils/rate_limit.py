@@ -0,0 +1,86 @@
+"""Token bucket limiting STK pushes per till, shared by all workers through Redis.
+
+The bucket lives in a Redis hash and is updated by a Lua script, so taking
+a token is one atomic round trip. A caller willing to wait reserves the next
+token and sleeps until it is due, rather than polling, which keeps the send
+rate steady at the configured rate instead of bursting and backing off.
+"""
+
+import time
+
+import frappe
+
+BUCKET_KEY_PREFIX = "kcb_rate_limit:"
+
+# KEYS[1]: bucket, ARGV: rate per second, burst, longest acceptable wait in ms
+# returns the ms to wait before the reserved token is due, or -1 when that exceeds the limit
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000) - 1
+
+local wait = 0
+if tokens < 0 then
+	wait = math.ceil(-tokens * 1000 / rate)
+end
+if wait > max_wait then
+	return -1
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst * 1000 / rate) + wait + 1000)
+return wait
+"""
+
+_script = None
+
+
+def get_script():
+	global _script
+	if _script is None:
+		_script = frappe.cache.register_script(TOKEN_BUCKET_SCRIPT)
+	return _script
+
+
+def acquire(key: str, rate: float, burst: int, max_wait: float) -> bool:
+	"""Take a token from the bucket `key`, waiting up to `max_wait` seconds for it.
+
+	Returns False without waiting when the next token is further away than
+	that. A `rate` of 0 disables the limit.
+	"""
+	if not rate or rate <= 0:
+		return True
+
+	wait_ms = get_script()(
+		keys=[frappe.cache.make_key(BUCKET_KEY_PREFIX + key)],
+		args=[rate, max(int(burst or 1), 1), int(max_wait * 1000)],
+	)
+	if wait_ms < 0:
+		return False
+
+	if wait_ms:
+		time.sleep(wait_ms / 1000)
+	return True
+
+
+def acquire_stk_push(settings) -> bool:
+	"""Rate limit an STK push through `settings`, keyed by till so settings sharing one share the bucket"""
+	max_wait = frappe.flags.kcb_rate_limit_max_wait
+	if max_wait is None:
+		max_wait = settings.stk_push_max_wait or 0
+
+	return acquire(
+		f"stkpush:{settings.till_no or settings.name}",
+		rate=settings.stk_push_rate_limit,
+		burst=settings.stk_push_burst,
+		max_wait=max_wait,
+	)
@@ -0,0 +1,69 @@
+import json
+
+import frappe
+
+from .bulk_ingest import bulk_create_payment_transactions
+from .ipn import parse_notification
+from .signature import get_signature_verifier
+
+
+def parse_replay_line(line: str) -> tuple[frappe._dict, str | None]:
+	"""Decode one JSONL line into a parsed notification and its signature.
+
+	A line is either the raw IPN body itself, or an object of the form
+	{"body": "<raw IPN body>", "signature": "<signature header>"} when the
+	notification was captured together with its headers.
+	"""
+	record = json.loads(line)
+
+	if isinstance(record, dict) and "body" in record:
+		body = record["body"]
+		if not isinstance(body, str):
+			body = json.dumps(body)
+		return parse_notification(body), record.get("signature")
+
+	return parse_notification(line), None
+
+
+def ingest_lines(lines: list[tuple[int, str]], verify_signatures: bool = False) -> frappe._dict:
+	"""Ingest (line_number, line) pairs and return counts plus the rejected lines"""
+	result = frappe._dict(created=0, duplicate=0, rejected=[])
+	verifier = get_signature_verifier() if verify_signatures else None
+
+	line_numbers = []
+	notifications = []
+	for line_number, line in lines:
+		try:
+			notification, signature = parse_replay_line(line)
+		except ValueError as e:
+			result.rejected.append((line_number, f"Invalid JSON: {e!s}"))
+			continue
+
+		if verifier:
+			if not signature:
+				result.rejected.append((line_number, "Missing signature"))
+				continue
+			try:
+				verified = verifier.verify(notification.signing_bytes, signature.strip())
+			except ValueError:
+				verified = False
+
+			if not verified:
+				result.rejected.append((line_number, "Invalid signature"))
+				continue
+
+		line_numbers.append(line_number)
+		notifications.append(notification.fields)
+
+	outcomes = bulk_create_payment_transactions(notifications)
+	frappe.db.commit()
+
+	for line_number, outcome in zip(line_numbers, outcomes, strict=True):
+		if outcome.status == "Created":
+			result.created += 1
+		elif outcome.status == "Duplicate":
+			result.duplicate += 1
+		else:
+			result.rejected.append((line_number, outcome.error))
+
+	return result
@@ -0,0 +1,103 @@
+"""Recently seen kcb_transaction_ids, shared by all workers through Redis.
+
+Each id is stored as its own key (so Redis expires it after the TTL) holding
+the name of the KCB Payment Transaction it produced. A sorted set scored by
+time keeps the number of ids bounded. Commands go through pipelines so they
+reach Redis as-is, without the pickling done by frappe.cache's
+get_value/set_value.
+"""
+
+import time
+
+import frappe
+
+SEEN_KEY_PREFIX = "kcb_seen_txn:"
+SEEN_INDEX_KEY = "kcb_seen_txn_index"
+LOADED_MARKER_KEY = "kcb_seen_txn_loaded"
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_SIZE = 100_000
+
+
+def get_ttl() -> int:
+	return frappe.conf.get("kcb_seen_transactions_ttl") or DEFAULT_TTL
+
+
+def get_max_size() -> int:
+	return frappe.conf.get("kcb_seen_transactions_max") or DEFAULT_MAX_SIZE
+
+
+def make_key(key: str) -> str:
+	return frappe.cache.make_key(key)
+
+
+def get_seen_transaction(kcb_transaction_id: str) -> str | None:
+	"""Name recorded for `kcb_transaction_id` if it was seen recently"""
+	pipeline = frappe.cache.pipeline()
+	pipeline.set(make_key(LOADED_MARKER_KEY), 1, nx=True)
+	pipeline.get(make_key(SEEN_KEY_PREFIX + kcb_transaction_id))
+	first_use, name = pipeline.execute()
+
+	if first_use:
+		# Redis started empty (restart or flush), refill it from the table
+		frappe.enqueue(
+			"kcb_payments.kcb_payments.utils.seen_transactions.rebuild_seen_transactions",
+			queue="short",
+			job_id="kcb_seen_transactions_rebuild",
+			deduplicate=True,
+		)
+
+	return name.decode() if name else None
+
+
+def mark_seen(kcb_transaction_id: str, name: str) -> None:
+	mark_seen_many([(kcb_transaction_id, name)])
+
+
+def mark_seen_many(pairs: list[tuple[str, str]]) -> None:
+	"""Record (kcb_transaction_id, name) pairs and evict the oldest ids beyond the size limit"""
+	pairs = [(kcb_transaction_id, name) for kcb_transaction_id, name in pairs if kcb_transaction_id and name]
+	if not pairs:
+		return
+
+	ttl = get_ttl()
+	now = time.time()
+	index_key = make_key(SEEN_INDEX_KEY)
+
+	pipeline = frappe.cache.pipeline()
+	for kcb_transaction_id, name in pairs:
+		pipeline.set(make_key(SEEN_KEY_PREFIX + kcb_transaction_id), name, ex=ttl)
+	pipeline.zadd(index_key, {kcb_transaction_id: now for kcb_transaction_id, _name in pairs})
+	pipeline.zremrangebyscore(index_key, "-inf", now - ttl)
+	pipeline.zcard(index_key)
+	size = pipeline.execute()[-1]
+
+	if size > get_max_size():
+		evict(size - get_max_size())
+
+
+def evict(count: int) -> None:
+	index_key = make_key(SEEN_INDEX_KEY)
+	oldest = frappe.cache.pipeline().zrange(index_key, 0, count - 1).execute()[0]
+	if not oldest:
+		return
+
+	pipeline = frappe.cache.pipeline()
+	pipeline.delete(*(make_key(SEEN_KEY_PREFIX + member.decode()) for member in oldest))
+	pipeline.zrem(index_key, *oldest)
+	pipeline.execute()
+
+
+def rebuild_seen_transactions() -> None:
+	"""Load the most recent transactions within the TTL into the seen set"""
+	recent = frappe.get_all(
+		"KCB Payment Transaction",
+		filters={"creation": [">=", frappe.utils.add_to_date(None, seconds=-get_ttl())]},
+		fields=["kcb_transaction_id", "name"],
+		order_by="creation desc",
+		limit=get_max_size(),
+		as_list=True,
+	)
+
+	for start in range(0, len(recent), 1000):
+		mark_seen_many(recent[start : start + 1000])
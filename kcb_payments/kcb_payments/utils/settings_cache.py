@@ -0,0 +1,39 @@
+import frappe
+from frappe.model.document import Document
+
+SETTINGS_VERSION_CACHE_KEY = "kcb_mpesa_settings_version"
+
+# (site, settings name) -> (version, document)
+_settings: dict[tuple[str, str], tuple[str, Document]] = {}
+
+
+def get_settings_version() -> str:
+	version = frappe.cache.get_value(SETTINGS_VERSION_CACHE_KEY)
+	if not version:
+		version = frappe.generate_hash(length=10)
+		frappe.cache.set_value(SETTINGS_VERSION_CACHE_KEY, version)
+
+	return version
+
+
+def get_mpesa_settings(name: str) -> Document:
+	"""KCB Mpesa Settings kept in this process until any of them is saved.
+
+	Callers must treat the document as read-only, it is shared between requests.
+	"""
+	version = get_settings_version()
+	key = (frappe.local.site, name)
+
+	cached = _settings.get(key)
+	if cached and cached[0] == version:
+		return cached[1]
+
+	doc = frappe.get_doc("KCB Mpesa Settings", name)
+	_settings[key] = (version, doc)
+	return doc
+
+
+def clear_mpesa_settings_cache() -> None:
+	"""Make every worker reload settings on their next use"""
+	frappe.cache.set_value(SETTINGS_VERSION_CACHE_KEY, frappe.generate_hash(length=10))
+	_settings.clear()
@@ -0,0 +1,139 @@
+import base64
+import hashlib
+import re
+import threading
+
+import frappe
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
+# SubjectPublicKeyInfo (PUBLIC KEY) or PKCS#1 (RSA PUBLIC KEY) blocks, both read by load_pem_public_key
+PEM_BLOCK_PATTERN = re.compile(
+	r"-----BEGIN (?P<type>(?:RSA )?PUBLIC KEY)-----(?P<body>.+?)-----END (?P=type)-----", re.DOTALL
+)
+KEYS_VERSION_CACHE_KEY = "kcb_ipn_public_keys_version"
+
+
+def get_fingerprint(pem_body: str) -> str:
+	"""SHA-256 fingerprint of the DER encoded key, computed without parsing the key"""
+	der = base64.b64decode("".join(pem_body.split()))
+	return hashlib.sha256(der).hexdigest()
+
+
+def split_pem_blocks(source: str) -> list[tuple[str, str]]:
+	"""Return (fingerprint, pem) pairs for every public key block in `source`"""
+	blocks = []
+	for match in PEM_BLOCK_PATTERN.finditer(source or ""):
+		pem = match.group(0)
+		blocks.append((get_fingerprint(match.group("body")), pem))
+
+	return blocks
+
+
+class SignatureVerifier:
+	"""Verifies KCB IPN signatures against one or more active public keys.
+
+	An instance per site lives for the whole worker process. Parsed keys are
+	kept by fingerprint so a reload after KCB rotates keys only parses the new
+	ones.
+	"""
+
+	def __init__(self):
+		self.keys = {}
+		self.version = None
+		self.source = None
+		self.conf_keys = None
+		self.last_fingerprint = None
+		self._lock = threading.Lock()
+
+	@property
+	def fingerprints(self) -> list[str]:
+		return list(self.keys)
+
+	def load(self, source: str, version: str | None = None) -> None:
+		with self._lock:
+			keys = {}
+			for fingerprint, pem in split_pem_blocks(source):
+				if fingerprint in keys:
+					continue
+
+				keys[fingerprint] = self.keys.get(fingerprint) or serialization.load_pem_public_key(
+					pem.encode()
+				)
+
+			if not keys and (source or "").strip():
+				frappe.log_error(
+					"No PEM public key block found in the configured KCB public keys",
+					"KCB Signature Verification",
+				)
+
+			self.keys = keys
+			self.source = source
+			self.version = version
+
+	def verify(self, payload: bytes, signature: str) -> str | None:
+		"""Return the fingerprint of the key that produced `signature`, or None"""
+		signature_bytes = base64.b64decode(signature)
+
+		# the key that verified the previous notification is almost always the right one
+		keys = self.keys
+		candidates = sorted(keys, key=lambda fingerprint: fingerprint != self.last_fingerprint)
+
+		for fingerprint in candidates:
+			try:
+				keys[fingerprint].verify(signature_bytes, payload, padding.PKCS1v15(), hashes.SHA256())
+			except InvalidSignature:
+				continue
+
+			self.last_fingerprint = fingerprint
+			return fingerprint
+
+		return None
+
+
+# site -> verifier; the keys version lives in the site's cache, so each site needs its own
+_verifiers: dict[str, SignatureVerifier] = {}
+
+
+def get_key_source() -> str:
+	"""All configured public keys, site config first, then KCB IPN Settings"""
+	conf_keys = frappe.conf.get("kcb_public_key") or []
+	if isinstance(conf_keys, str):
+		conf_keys = [conf_keys]
+
+	settings_key = frappe.db.get_single_value("KCB IPN Settings", "public_key") or ""
+
+	return "\n".join([*conf_keys, settings_key])
+
+
+def get_keys_version() -> str:
+	version = frappe.cache.get_value(KEYS_VERSION_CACHE_KEY)
+	if not version:
+		version = frappe.generate_hash(length=10)
+		frappe.cache.set_value(KEYS_VERSION_CACHE_KEY, version)
+
+	return version
+
+
+def get_signature_verifier() -> SignatureVerifier:
+	"""Return this site's verifier, reloading its keys if they changed since the last call"""
+	version = get_keys_version()
+	conf_keys = frappe.conf.get("kcb_public_key")
+
+	verifier = _verifiers.get(frappe.local.site)
+	if verifier is None:
+		verifier = _verifiers[frappe.local.site] = SignatureVerifier()
+
+	if verifier.version != version or verifier.conf_keys != conf_keys:
+		verifier.load(get_key_source(), version=version)
+		verifier.conf_keys = conf_keys
+
+	return verifier
+
+
+def clear_signature_verifier_cache() -> None:
+	"""Make every worker reload its keys on the next notification"""
+	frappe.cache.set_value(KEYS_VERSION_CACHE_KEY, frappe.generate_hash(length=10))
+	if verifier := _verifiers.get(frappe.local.site):
+		verifier.version = None
@@ -0,0 +1,22 @@
+import frappe
+
+# the IPN for an STK payment normally lands seconds after its callback
+STK_RECEIPT_CACHE_TTL = 15 * 60
+
+
+def get_receipt_cache_key(mpesa_receipt_number: str) -> str:
+	return f"kcb_stk_receipt:{mpesa_receipt_number}"
+
+
+def cache_stk_receipt(mpesa_receipt_number: str, reference_name: str) -> None:
+	"""Remember which document a completed STK request paid for"""
+	if not mpesa_receipt_number:
+		return
+
+	frappe.cache.set_value(
+		get_receipt_cache_key(mpesa_receipt_number), reference_name, expires_in_sec=STK_RECEIPT_CACHE_TTL
+	)
+
+
+def get_cached_stk_receipt(mpesa_receipt_number: str) -> str | None:
+	return frappe.cache.get_value(get_receipt_cache_key(mpesa_receipt_number))
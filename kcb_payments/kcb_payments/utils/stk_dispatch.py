@@ -0,0 +1,67 @@
+"""Background dispatch of STK pushes.
+
+With "Send STK Push in Background" enabled on the KCB Mpesa Settings, a
+submitted KCB Mpesa STK Request is saved as Queued and the Buni call happens
+in a job on a dedicated RQ queue, outside the cashier's transaction.
+
+The queue is named by `kcb_stk_queue` in site config (default "kcb_stk") and
+must be declared under `workers` in common_site_config.json, for example
+{"workers": {"kcb_stk": {"timeout": 120, "background_workers": 4}}}, where
+background_workers sets how many workers `bench setup supervisor` starts for
+it. Until it is declared, jobs go to the short queue.
+"""
+
+import frappe
+from frappe.utils.background_jobs import get_queue, get_queues_timeout
+
+DEFAULT_STK_QUEUE = "kcb_stk"
+FALLBACK_QUEUE = "short"
+QUEUED_MAX_WAIT = 30
+
+
+def get_stk_queue() -> str:
+	queue = frappe.conf.get("kcb_stk_queue") or DEFAULT_STK_QUEUE
+	return queue if queue in get_queues_timeout() else FALLBACK_QUEUE
+
+
+def enqueue_stk_push(stk_request: str) -> None:
+	"""Send the push for `stk_request` once the submitting transaction commits"""
+	frappe.enqueue(
+		"kcb_payments.kcb_payments.utils.stk_dispatch.dispatch_stk_push",
+		queue=get_stk_queue(),
+		job_id=f"kcb_stk_push:{stk_request}",
+		deduplicate=True,
+		enqueue_after_commit=True,
+		stk_request=stk_request,
+	)
+
+
+def dispatch_stk_push(stk_request: str) -> None:
+	from ..api.kcb_mpesa import generate_stk_push
+
+	doc = frappe.get_doc("KCB Mpesa STK Request", stk_request)
+	if doc.status != "Queued":
+		# already sent, or cancelled while waiting
+		return
+
+	# nobody is waiting on a queued push, so it can wait longer for the till's rate limit
+	if frappe.flags.kcb_rate_limit_max_wait is None:
+		frappe.flags.kcb_rate_limit_max_wait = QUEUED_MAX_WAIT
+
+	try:
+		generate_stk_push(**doc.get_stk_push_args())
+	except Exception as e:
+		frappe.db.rollback()
+		doc.reload()
+		doc.status = "Failed"
+		doc.error_message = "STK Push dispatch failed"
+		doc.error_description = str(e)
+		doc.save(ignore_permissions=True)
+		frappe.db.commit()
+		frappe.log_error(title="KCB STK Push Dispatch Error")
+
+
+def get_queue_depth() -> frappe._dict:
+	"""Jobs waiting in and currently running on the STK queue"""
+	queue = get_queue(get_stk_queue())
+	return frappe._dict(queue=queue.name, queued=queue.count, started=queue.started_job_registry.count)
@@ -0,0 +1,156 @@
+"""Accounting side effects of completed STK pushes, run outside the callback.
+
+The callback only records the result on the KCB Mpesa STK Request and marks
+its post processing Pending. A background job then submits the invoice,
+creates the payment entry or updates the payment request. A failed attempt
+is retried by the scheduler after RETRY_DELAY_SECONDS; after MAX_RETRIES the
+request is Poisoned and listed by the KCB STK Post Processing Failures report
+until someone requeues it.
+"""
+
+import frappe
+from frappe.utils import add_to_date, now
+from pypika.terms import Case
+
+from .settings_cache import get_mpesa_settings
+
+MAX_RETRIES = 5
+RETRY_DELAY_SECONDS = 300
+STALE_CLAIM_MINUTES = 15
+BATCH_SIZE = 100
+
+
+def enqueue_post_processing(stk_request: str) -> None:
+	"""Run the side effects of `stk_request` once the callback's transaction commits"""
+	frappe.enqueue(
+		"kcb_payments.kcb_payments.utils.stk_post_processing.process_stk_request",
+		queue="default",
+		job_id=f"kcb_stk_post_processing:{stk_request}",
+		deduplicate=True,
+		enqueue_after_commit=True,
+		stk_request=stk_request,
+	)
+
+
+def claim(names: list[str] | None = None, batch_size: int = BATCH_SIZE) -> list[str]:
+	"""Mark waiting requests as Processing and return their names.
+
+	Rows are locked with SKIP LOCKED so a job and the scheduler never pick the
+	same request. Failed requests wait RETRY_DELAY_SECONDS before they are
+	picked up again.
+	"""
+	names_condition = "and name in %(names)s" if names else ""
+	names = frappe.db.sql(
+		f"""
+		select name
+		from `tabKCB Mpesa STK Request`
+		where (post_processing_status = 'Pending'
+			or (post_processing_status = 'Failed' and modified < %(retry_before)s))
+			{names_condition}
+		order by creation
+		limit %(batch_size)s
+		for update skip locked
+		""",
+		{
+			"names": names,
+			"retry_before": add_to_date(now(), seconds=-RETRY_DELAY_SECONDS),
+			"batch_size": batch_size,
+		},
+		pluck=True,
+	)
+
+	if names:
+		frappe.db.set_value(
+			"KCB Mpesa STK Request", {"name": ["in", names]}, "post_processing_status", "Processing"
+		)
+
+	frappe.db.commit()
+	return names
+
+
+def release_stale_claims() -> None:
+	"""Return requests a dead worker left in Processing to the retry queue, as a failed attempt"""
+	request = frappe.qb.DocType("KCB Mpesa STK Request")
+	(
+		frappe.qb.update(request)
+		.set(
+			request.post_processing_status,
+			Case().when(request.post_processing_retry_count + 1 >= MAX_RETRIES, "Poisoned").else_("Failed"),
+		)
+		.set(request.post_processing_retry_count, request.post_processing_retry_count + 1)
+		.set(request.modified, now())
+		.where(request.post_processing_status == "Processing")
+		.where(request.modified < add_to_date(now(), minutes=-STALE_CLAIM_MINUTES))
+	).run()
+	frappe.db.commit()
+
+
+def process_stk_request(stk_request: str) -> None:
+	if claim([stk_request]):
+		post_process(stk_request)
+
+
+def process_pending_stk_requests() -> None:
+	"""Retry failed requests and pick up any whose job was lost"""
+	release_stale_claims()
+
+	while names := claim():
+		for name in names:
+			post_process(name)
+
+
+def post_process(stk_request: str) -> None:
+	from .utils import handle_successful_transaction
+
+	doc = frappe.get_doc("KCB Mpesa STK Request", stk_request)
+	metadata_dict = {
+		"Amount": doc.transaction_amount,
+		"MpesaReceiptNumber": doc.mpesa_receipt_number,
+		"TransactionDate": doc.transaction_date,
+		"PhoneNumber": doc.callback_phone_number,
+	}
+
+	try:
+		handle_successful_transaction(
+			doc, metadata_dict, get_mpesa_settings(doc.kcb_mpesa_settings), doc.checkout_request_id
+		)
+	except Exception:
+		frappe.db.rollback()
+		mark_failed(doc, frappe.get_traceback())
+	else:
+		frappe.db.set_value(
+			"KCB Mpesa STK Request",
+			stk_request,
+			{
+				"post_processing_status": "Processed",
+				"post_processing_error": None,
+				"post_processed_at": now(),
+			},
+		)
+
+	frappe.db.commit()
+
+
+def mark_failed(doc, error: str) -> None:
+	retry_count = (doc.post_processing_retry_count or 0) + 1
+	frappe.db.set_value(
+		"KCB Mpesa STK Request",
+		doc.name,
+		{
+			"post_processing_status": "Poisoned" if retry_count >= MAX_RETRIES else "Failed",
+			"post_processing_retry_count": retry_count,
+			"post_processing_error": error,
+		},
+	)
+
+
+@frappe.whitelist(methods=["POST"])
+def requeue_post_processing(name: str) -> None:
+	frappe.only_for(["System Manager", "Accounts Manager"])
+
+	frappe.db.set_value(
+		"KCB Mpesa STK Request",
+		name,
+		{"post_processing_status": "Pending", "post_processing_retry_count": 0},
+	)
+	enqueue_post_processing(name)
@@ -0,0 +1,134 @@
+"""Resolve STK requests whose callback never arrived.
+
+Every minute the sweeper picks KCB Mpesa STK Requests that have been In
+Progress for longer than `kcb_stk_sweep_after_minutes` (default 2) and asks
+the status query for their outcome, a batch per KCB Mpesa Settings. The
+outcomes are applied with one UPDATE per batch instead of saving each
+document, and Completed requests go on to post processing like a callback.
+
+The status query is the last method listed under the `kcb_stk_status_query`
+hook. It is called with the settings and a list of requests (name,
+merchant_request_id, checkout_request_id, timestamp) and returns
+{name: {"status": "Completed" | "Failed", ...}} for the requests it could
+resolve; other fields in a result (result_code, result_desc,
+mpesa_receipt_number, transaction_amount, transaction_date,
+callback_phone_number) are stored on the request. Requests left out stay In
+Progress until a later sweep. The default query fails requests older than
+`kcb_stk_expire_after_minutes` (default 30), by which time the prompt on the
+customer's phone has long expired.
+"""
+
+import frappe
+from frappe.utils import add_to_date, now
+
+from .stk_post_processing import enqueue_post_processing
+
+DEFAULT_SWEEP_AFTER_MINUTES = 2
+DEFAULT_EXPIRE_AFTER_MINUTES = 30
+BATCH_SIZE = 100
+
+# fields a status query may set, besides status
+RESULT_FIELDS = (
+	"result_code",
+	"result_desc",
+	"mpesa_receipt_number",
+	"transaction_amount",
+	"transaction_date",
+	"callback_phone_number",
+)
+
+
+def get_status_query():
+	return frappe.get_attr(frappe.get_hooks("kcb_stk_status_query")[-1])
+
+
+def expire_stale_requests(settings, stk_requests: list[frappe._dict]) -> dict[str, dict]:
+	"""Default status query: fail requests that have waited past the expiry"""
+	expire_before = add_to_date(
+		now(),
+		minutes=-(frappe.conf.get("kcb_stk_expire_after_minutes") or DEFAULT_EXPIRE_AFTER_MINUTES),
+		as_datetime=True,
+	)
+
+	return {
+		stk_request.name: {"status": "Failed", "result_desc": "No callback received from KCB"}
+		for stk_request in stk_requests
+		if stk_request.timestamp < expire_before
+	}
+
+
+def sweep_stk_requests() -> None:
+	sweep_before = add_to_date(
+		now(), minutes=-(frappe.conf.get("kcb_stk_sweep_after_minutes") or DEFAULT_SWEEP_AFTER_MINUTES)
+	)
+	status_query = get_status_query()
+
+	# served by the (status, timestamp) index
+	overdue = frappe.get_all(
+		"KCB Mpesa STK Request",
+		filters={"status": "In Progress", "docstatus": 1, "timestamp": ["<", sweep_before]},
+		fields=["name", "kcb_mpesa_settings", "merchant_request_id", "checkout_request_id", "timestamp"],
+		order_by="timestamp asc",
+	)
+
+	by_settings = {}
+	for stk_request in overdue:
+		by_settings.setdefault(stk_request.kcb_mpesa_settings, []).append(stk_request)
+
+	for settings_name, stk_requests in by_settings.items():
+		settings = frappe.get_cached_doc("KCB Mpesa Settings", settings_name)
+		for start in range(0, len(stk_requests), BATCH_SIZE):
+			batch = stk_requests[start : start + BATCH_SIZE]
+			try:
+				results = status_query(settings, batch)
+			except Exception:
+				frappe.log_error(title="KCB STK Status Query Error")
+				continue
+
+			if results:
+				apply_results(results)
+
+
+def apply_results(results: dict[str, dict]) -> None:
+	"""Move In Progress requests to the status in `results`, skipping any a callback resolved meanwhile"""
+	# lock the rows so a callback arriving now waits for this transaction and then sees the new status
+	names = frappe.db.sql(
+		"""
+		select name
+		from `tabKCB Mpesa STK Request`
+		where name in %(names)s and status = 'In Progress'
+		for update skip locked
+		""",
+		{"names": list(results)},
+		pluck=True,
+	)
+
+	updates = {}
+	for name in names:
+		result = results[name]
+		values = {field: result[field] for field in RESULT_FIELDS if result.get(field) is not None}
+		if result["status"] == "Completed":
+			values.update(status="Completed", post_processing_status="Pending")
+		else:
+			values.update(status="Failed")
+		updates[name] = values
+
+	if not updates:
+		frappe.db.commit()
+		return
+
+	failed = [name for name, values in updates.items() if values["status"] == "Failed"]
+	completed = [name for name in updates if name not in failed]
+
+	if failed and all(updates[name] == updates[failed[0]] for name in failed):
+		# e.g. every expired request: a single UPDATE ... WHERE name IN (...)
+		frappe.db.set_value("KCB Mpesa STK Request", {"name": ["in", failed]}, updates[failed[0]])
+	elif failed:
+		frappe.db.bulk_update("KCB Mpesa STK Request", {name: updates[name] for name in failed})
+
+	if completed:
+		frappe.db.bulk_update("KCB Mpesa STK Request", {name: updates[name] for name in completed})
+		for name in completed:
+			enqueue_post_processing(name)
+
+	frappe.db.commit()
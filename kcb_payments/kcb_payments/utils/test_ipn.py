@@ -0,0 +1,148 @@
+# Copyright (c) 2025, Team Web Africa and Contributors
+# See license.txt
+
+import json
+from datetime import datetime
+
+from frappe.tests.utils import FrappeTestCase
+
+from .ipn import (
+	canonicalize,
+	get_cents_values,
+	get_missing_fields,
+	parse_notification,
+	parse_transaction_datetime,
+	to_cents,
+)
+
+# Notification bodies as captured from KCB, whitespace and escapes untouched
+TILL_PAYMENT = b"""{
+    "header": {
+        "messageID": "232323_KCBOrg_8875661561",
+        "originatorConversationID": "TL1AB2CD3E",
+        "channelCode": "206",
+        "timeStamp": "2025-12-03T22:15:41.123"
+    },
+    "requestPayload": {
+        "additionalData": {
+            "notificationData": {
+                "businessKey": "7504343#ACC-SINV-2026-00780",
+                "businessKeyType": "Till",
+                "debitAccountNumber": "",
+                "debitMSISDN": "254712345678",
+                "transactionAmt": 1500.00,
+                "transactionDate": "20251203221541",
+                "transactionID": "FT25337XYZ12",
+                "firstName": "JOHN",
+                "middleName": "",
+                "lastName": "DOE",
+                "currency": "KES",
+                "narration": "Payment for invoice",
+                "transactionType": "C",
+                "balance": ""
+            }
+        }
+    }
+}"""
+
+PAYMENT_REQUEST = (
+	b'{"header":{"messageID":"1764791741_KCBOrg_0a1b2c3d4e","originatorConversationID":"TL3PQ4RS5T",'
+	b'"channelCode":"206","timeStamp":"2025-12-03 22:15:41"},"requestPayload":{"additionalData":'
+	b'{"notificationData":{"businessKey":"7504343#ACC-PRQ-2026-00012","businessKeyType":"Till",'
+	b'"debitMSISDN":"254798765432","transactionAmt":"250","transactionDate":"20251203221541",'
+	b'"transactionID":"FT25337ABC34","firstName":"WANJIR\\u0168","middleName":"N.","lastName":'
+	b'"M\\u00fcller","currency":"KES","narration":"Malipo \xe2\x80\x94 order #12","transactionType":"C","balance":1234.5}}}}'
+)
+
+CANONICAL_TILL_PAYMENT = (
+	b'{"header":{"messageID":"232323_KCBOrg_8875661561","originatorConversationID":"TL1AB2CD3E",'
+	b'"channelCode":"206","timeStamp":"2025-12-03T22:15:41.123"},'
+	b'"requestPayload":{"additionalData":{"notificationData":{"businessKey":"7504343#ACC-SINV-2026-00780",'
+	b'"businessKeyType":"Till","debitAccountNumber":"","debitMSISDN":"254712345678",'
+	b'"transactionAmt":1500.0,"transactionDate":"20251203221541","transactionID":"FT25337XYZ12",'
+	b'"firstName":"JOHN","middleName":"","lastName":"DOE","currency":"KES",'
+	b'"narration":"Payment for invoice","transactionType":"C","balance":""}}}}'
+)
+
+CANONICAL_PAYMENT_REQUEST = (
+	b'{"header":{"messageID":"1764791741_KCBOrg_0a1b2c3d4e","originatorConversationID":"TL3PQ4RS5T",'
+	b'"channelCode":"206","timeStamp":"2025-12-03 22:15:41"},'
+	b'"requestPayload":{"additionalData":{"notificationData":{"businessKey":"7504343#ACC-PRQ-2026-00012",'
+	b'"businessKeyType":"Till","debitMSISDN":"254798765432","transactionAmt":"250",'
+	b'"transactionDate":"20251203221541","transactionID":"FT25337ABC34","firstName":"WANJIR\\u0168",'
+	b'"middleName":"N.","lastName":"M\\u00fcller","currency":"KES",'
+	b'"narration":"Malipo \\u2014 order #12","transactionType":"C","balance":1234.5}}}}'
+)
+
+
+class TestIPNParsing(FrappeTestCase):
+	def test_canonical_bytes_are_pinned(self):
+		self.assertEqual(parse_notification(TILL_PAYMENT).signing_bytes, CANONICAL_TILL_PAYMENT)
+		self.assertEqual(parse_notification(PAYMENT_REQUEST).signing_bytes, CANONICAL_PAYMENT_REQUEST)
+
+	def test_canonical_bytes_match_previous_implementation(self):
+		for raw in (TILL_PAYMENT, PAYMENT_REQUEST):
+			legacy = json.dumps(json.loads(raw.decode("utf-8")), separators=(",", ":")).encode("utf-8")
+			self.assertEqual(parse_notification(raw).signing_bytes, legacy)
+			self.assertEqual(parse_notification(raw.decode("utf-8")).signing_bytes, legacy)
+
+	def test_canonicalize_is_stable(self):
+		notification = parse_notification(PAYMENT_REQUEST)
+		self.assertEqual(canonicalize(json.loads(notification.signing_bytes)), notification.signing_bytes)
+
+	def test_fields_extracted_in_same_pass(self):
+		fields = parse_notification(TILL_PAYMENT).fields
+
+		self.assertEqual(fields.message_id, "232323_KCBOrg_8875661561")
+		self.assertEqual(fields.originator_conversation_id, "TL1AB2CD3E")
+		self.assertEqual(fields.channel_code, "206")
+		self.assertEqual(fields.timestamp, "2025-12-03T22:15:41.123")
+		self.assertEqual(fields.bill_reference, "7504343#ACC-SINV-2026-00780")
+		self.assertEqual(fields.mobile_number, "254712345678")
+		self.assertEqual(fields.amount, 1500.0)
+		self.assertEqual(fields.kcb_transaction_id, "FT25337XYZ12")
+		self.assertEqual(fields.middle_name, "")
+		self.assertEqual(get_missing_fields(fields), [])
+
+	def test_non_ascii_names_survive(self):
+		fields = parse_notification(PAYMENT_REQUEST).fields
+
+		self.assertEqual(fields.first_name, "WANJIR\u0168")
+		self.assertEqual(fields.last_name, "M\u00fcller")
+		self.assertEqual(fields.narration, "Malipo \u2014 order #12")
+
+	def test_empty_and_partial_bodies(self):
+		self.assertEqual(parse_notification(b"").data, {})
+		self.assertEqual(parse_notification(b"").signing_bytes, b"")
+
+		notification = parse_notification(b'{"header":{"messageID":"1"}}')
+		self.assertEqual(notification.fields.message_id, "1")
+		self.assertEqual(notification.fields.originator_conversation_id, "")
+		self.assertEqual(
+			get_missing_fields(notification.fields),
+			["bill_reference", "mobile_number", "amount", "kcb_transaction_id"],
+		)
+
+	def test_transaction_datetime_parsed_from_either_format(self):
+		self.assertEqual(
+			parse_transaction_datetime(parse_notification(TILL_PAYMENT).fields),
+			datetime(2025, 12, 3, 22, 15, 41),
+		)
+		self.assertEqual(
+			parse_transaction_datetime({"transaction_date": "", "timestamp": "2025-12-03 22:15:41"}),
+			datetime(2025, 12, 3, 22, 15, 41),
+		)
+		self.assertEqual(
+			parse_transaction_datetime(
+				{"transaction_date": "garbled", "timestamp": "2025-12-03T22:15:41.123"}
+			),
+			datetime(2025, 12, 3, 22, 15, 41, 123000),
+		)
+		self.assertIsNone(parse_transaction_datetime({"transaction_date": "", "timestamp": ""}))
+
+	def test_cents_are_exact(self):
+		self.assertEqual(to_cents(0.1 + 0.2), 30)
+		self.assertEqual(to_cents("1500.005"), 150001)
+		self.assertEqual(to_cents(None), 0)
+		self.assertEqual(get_cents_values(100.3, 100.1 + 0.2), {"amount_cents": 10030, "remaining_cents": 0})
+		self.assertEqual(get_cents_values(250, 99.99), {"amount_cents": 25000, "remaining_cents": 15001})
@@ -0,0 +1,35 @@
+# Copyright (c) 2026, Team Web Africa and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from .ipn import get_transaction_values, parse_notification
+from .test_ipn import PAYMENT_REQUEST, TILL_PAYMENT
+from .transaction_search import get_mobile_prefix, get_search_values
+
+
+class TestTransactionSearch(FrappeTestCase):
+	def test_search_values_stored_on_ingest(self):
+		values = get_transaction_values(parse_notification(TILL_PAYMENT).fields)
+
+		self.assertEqual(values["search_mobile"], "254712345678")
+		self.assertEqual(values["search_name"], "john doe")
+		self.assertEqual(values["search_receipt"], "TL1AB2CD3E")
+
+	def test_search_name_keeps_non_ascii(self):
+		values = get_search_values(parse_notification(PAYMENT_REQUEST).fields)
+
+		self.assertEqual(values["search_name"], "wanjirũ n. müller")
+
+	def test_mobile_numbers_are_canonical(self):
+		for number in ("0712345678", "+254 712 345 678", "254712345678", "712-345-678"):
+			self.assertEqual(get_search_values({"mobile_number": number})["search_mobile"], "254712345678")
+
+		# not a Kenyan mobile number, kept as digits rather than rejected
+		self.assertEqual(get_search_values({"mobile_number": "+1 (555) 0100"})["search_mobile"], "15550100")
+
+	def test_partial_mobile_numbers_become_prefixes(self):
+		self.assertEqual(get_mobile_prefix("0712"), "254712")
+		self.assertEqual(get_mobile_prefix("712"), "254712")
+		self.assertEqual(get_mobile_prefix("+25471"), "25471")
+		self.assertEqual(get_mobile_prefix("0712345678"), "254712345678")
@@ -0,0 +1,169 @@
+"""Buni access tokens shared by all workers through Redis.
+
+One token is cached per KCB Mpesa Settings document. When it nears expiry a
+single worker, holding a Redis lock, fetches the next one; the others keep
+using the current token while it is still valid, or wait for the refresh
+when it is not. A scheduled job renews tokens ahead of expiry so the hot
+path rarely refreshes at all.
+"""
+
+import time
+
+import frappe
+from frappe.utils import add_to_date
+from redis.exceptions import LockError
+
+from .circuit_breaker import CircuitOpenError
+from .diagnostics import record
+
+TOKEN_KEY_PREFIX = "kcb_access_token:"
+LOCK_KEY_PREFIX = "kcb_access_token_lock:"
+
+# refresh this long before expiry, while the current token still works
+REFRESH_MARGIN = 60
+# never hand out a token closer than this to its expiry
+EXPIRY_BUFFER = 5
+# the lock outlives a slow /token call with its retries
+LOCK_TIMEOUT = 60
+# how long a worker without a usable token waits for another worker's refresh
+WAIT_TIMEOUT = 30
+# the scheduled refresh renews tokens expiring within this many seconds
+DEFAULT_REFRESH_WINDOW = 5 * 60
+
+
+def get_cached_token(settings_name: str) -> frappe._dict | None:
+	# expires=True skips the request-local copy, another worker may refresh mid-request
+	return frappe.cache.get_value(TOKEN_KEY_PREFIX + settings_name, expires=True)
+
+
+def set_cached_token(settings_name: str, access_token: str, expires_in: int) -> frappe._dict:
+	token = frappe._dict(access_token=access_token, expires_at=time.time() + expires_in)
+	frappe.cache.set_value(TOKEN_KEY_PREFIX + settings_name, token, expires_in_sec=expires_in)
+	return token
+
+
+def clear_cached_token(settings_name: str) -> None:
+	frappe.cache.delete_value(TOKEN_KEY_PREFIX + settings_name)
+
+
+def seconds_left(token: frappe._dict | None) -> float:
+	return token.expires_at - time.time() if token else 0
+
+
+def get_access_token(settings) -> str | None:
+	"""A valid access token for `settings`, refreshed by at most one worker at a time"""
+	token = get_cached_token(settings.name)
+	if seconds_left(token) > REFRESH_MARGIN:
+		return token.access_token
+
+	usable = seconds_left(token) > EXPIRY_BUFFER
+	lock = get_lock(settings.name)
+
+	# with a usable token there is no point queueing behind the refresh already running
+	if lock.acquire(blocking=not usable, blocking_timeout=WAIT_TIMEOUT):
+		try:
+			# the worker that held the lock before us may have refreshed already
+			token = get_cached_token(settings.name)
+			if seconds_left(token) > REFRESH_MARGIN:
+				return token.access_token
+
+			try:
+				access_token = refresh_access_token(settings)
+			except CircuitOpenError:
+				# Buni is down, a token that still works is better than none
+				if seconds_left(token) > EXPIRY_BUFFER:
+					return token.access_token
+				raise
+
+			if access_token:
+				return access_token
+			return token.access_token if seconds_left(token) > EXPIRY_BUFFER else None
+		finally:
+			release(lock)
+
+	token = get_cached_token(settings.name)
+	return token.access_token if seconds_left(token) > EXPIRY_BUFFER else None
+
+
+def get_lock(settings_name: str):
+	return frappe.cache.lock(frappe.cache.make_key(LOCK_KEY_PREFIX + settings_name), timeout=LOCK_TIMEOUT)
+
+
+def release(lock) -> None:
+	try:
+		lock.release()
+	except LockError:
+		# held past LOCK_TIMEOUT, it already expired
+		pass
+
+
+def refresh_access_token(settings) -> str | None:
+	"""Fetch a new token from Buni and share it, the caller must hold the lock"""
+	response = settings.request_access_token()
+	if not response:
+		return None
+
+	return set_cached_token(settings.name, response.access_token, response.expires_in).access_token
+
+
+def get_refresh_window() -> int:
+	return frappe.conf.get("kcb_token_refresh_window") or DEFAULT_REFRESH_WINDOW
+
+
+def refresh_expiring_tokens() -> None:
+	"""Refresh every settings' token that is missing or expires within the refresh window.
+
+	Runs every minute, and once after migrate so a deploy starts with warm
+	tokens. STK pushes then find a fresh token instead of waiting on /token.
+	"""
+	window = get_refresh_window()
+
+	for settings_name in frappe.get_all(
+		"KCB Mpesa Settings", filters={"username": ["is", "set"]}, pluck="name"
+	):
+		if seconds_left(get_cached_token(settings_name)) > window:
+			continue
+
+		lock = get_lock(settings_name)
+		# a worker on the hot path is already refreshing this one
+		if not lock.acquire(blocking=False):
+			continue
+
+		try:
+			if seconds_left(get_cached_token(settings_name)) > window:
+				continue
+			if refresh_access_token(frappe.get_doc("KCB Mpesa Settings", settings_name)):
+				# display only, off the hot path: the form shows when the shared token runs out
+				token = get_cached_token(settings_name)
+				frappe.db.set_value(
+					"KCB Mpesa Settings",
+					settings_name,
+					{
+						"expires_in": int(seconds_left(token)),
+						"token_expiry": add_to_date(None, seconds=seconds_left(token)),
+					},
+					update_modified=False,
+				)
+		except CircuitOpenError:
+			# the next run tries again, once the breaker lets a probe through
+			pass
+		except Exception:
+			record(
+				f"token_refresh:{settings_name}",
+				"KCB Token Refresh Failed",
+				f"Settings: {settings_name}\n{frappe.get_traceback()}",
+			)
+		finally:
+			release(lock)
+
+	frappe.db.commit()
+
+
+def warm_tokens() -> None:
+	frappe.enqueue(
+		"kcb_payments.kcb_payments.utils.token_cache.refresh_expiring_tokens",
+		queue="short",
+		job_id="kcb_refresh_expiring_tokens",
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
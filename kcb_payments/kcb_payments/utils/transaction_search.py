@@ -0,0 +1,148 @@
+"""Indexed search over KCB Payment Transactions.
+
+Ingest stores normalised copies of the searchable values: the payer's
+mobile number in 2547... form, the lower-cased full name and the upper-cased
+receipt (originator conversation id). Searches then match those columns by
+exact value or prefix, which their indexes serve, instead of LIKE '%x%' over
+the raw fields. Names are matched per word through a FULLTEXT index on
+MariaDB and by prefix elsewhere.
+
+Unreconciled transactions are listed a page at a time in (status desc,
+creation desc, name desc) order, which the (status, creation) index serves
+with a single backward scan. The order is newest first within each status,
+not overall: every Unreconciled transaction comes before the Partly
+Reconciled ones. Every row carries a `cursor`; passing the last row's cursor
+back returns the page after it, however deep, without an OFFSET.
+"""
+
+import re
+
+import frappe
+from frappe.query_builder import Criterion
+from pypika.terms import LiteralValue
+
+from .utils import normalize_mobile_number
+
+FULLTEXT_INDEX = "search_name_fulltext"
+# shortest word InnoDB puts in a FULLTEXT index (innodb_ft_min_token_size)
+MIN_FULLTEXT_WORD = 3
+
+UNRECONCILED_STATUSES = ("Partly Reconciled", "Unreconciled")
+DEFAULT_PAGE_LENGTH = 50
+MAX_PAGE_LENGTH = 500
+
+
+def get_search_values(fields: dict) -> dict:
+	"""Search column values for a transaction with the given raw fields"""
+	mobile_number = fields.get("mobile_number") or ""
+	full_name = " ".join(
+		part
+		for part in (fields.get("first_name"), fields.get("middle_name"), fields.get("last_name"))
+		if part
+	)
+
+	return {
+		"search_mobile": normalize_mobile_number(mobile_number) or re.sub(r"\D", "", str(mobile_number)),
+		"search_name": normalize_name(full_name),
+		"search_receipt": normalize_receipt(fields.get("originator_conversation_id")),
+	}
+
+
+def normalize_name(name: str | None) -> str:
+	return " ".join((name or "").lower().split())
+
+
+def normalize_receipt(receipt: str | None) -> str:
+	return (receipt or "").strip().upper()
+
+
+def get_mobile_prefix(phone_number: str) -> str:
+	"""The 254... prefix a partially typed mobile number (07.., 7.., +2547..) stands for"""
+	if number := normalize_mobile_number(phone_number):
+		return number
+
+	digits = re.sub(r"\D", "", str(phone_number))
+	for prefix in ("254", "0"):
+		if digits.startswith(prefix):
+			return "254" + digits[len(prefix) :]
+
+	return "254" + digits
+
+
+def get_search_conditions(
+	table, phone_number: str | None = None, name: str | None = None, receipt: str | None = None
+) -> list[Criterion]:
+	"""Conditions on `table` (KCB Payment Transaction) for the dialog's search inputs"""
+	conditions = []
+
+	if phone_number:
+		prefix = get_mobile_prefix(phone_number)
+		if len(prefix) == 12:
+			conditions.append(table.search_mobile == prefix)
+		else:
+			conditions.append(table.search_mobile.like(f"{escape_like(prefix)}%"))
+
+	if receipt:
+		conditions.append(table.search_receipt.like(f"{escape_like(normalize_receipt(receipt))}%"))
+
+	if name and (name := normalize_name(name)):
+		conditions.append(get_name_condition(table, name))
+
+	return conditions
+
+
+def get_name_condition(table, name: str) -> Criterion:
+	words = [re.sub(r"[^\w]", "", word) for word in name.split()]
+	if frappe.db.db_type == "mariadb" and all(len(word) >= MIN_FULLTEXT_WORD for word in words):
+		# every word required, each as a prefix: "joh kam" finds "john kamau" and "kamau john"
+		against = " ".join(f"+{word}*" for word in words)
+		return LiteralValue(f"match(search_name) against ({frappe.db.escape(against)} in boolean mode)")
+
+	return table.search_name.like(f"{escape_like(name)}%")
+
+
+def escape_like(value: str) -> str:
+	return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def get_unreconciled_query(table, cursor: str | None = None, page_length: int | None = None):
+	"""A page of unreconciled transactions in `table`, starting after `cursor`; callers add columns and filters.
+
+	Rows are newest first within each status, Unreconciled before Partly Reconciled, not newest first overall.
+	"""
+	page_length = min(int(page_length or DEFAULT_PAGE_LENGTH), MAX_PAGE_LENGTH)
+	query = (
+		frappe.qb.from_(table)
+		.select(table.status, table.creation)
+		.where(table.status.isin(UNRECONCILED_STATUSES))
+		.orderby(table.status, table.creation, table.name, order=frappe.qb.desc)
+		.limit(page_length)
+	)
+
+	if cursor:
+		status, creation, name = cursor.split("|", 2)
+		query = query.where(
+			(table.status < status)
+			| (
+				(table.status == status)
+				& ((table.creation < creation) | ((table.creation == creation) & (table.name < name)))
+			)
+		)
+
+	return query
+
+
+def add_cursors(rows: list[dict]) -> list[dict]:
+	for row in rows:
+		row["cursor"] = f"{row['status']}|{row['creation']}|{row['name']}"
+	return rows
+
+
+def add_fulltext_index() -> None:
+	"""FULLTEXT index on search_name, MariaDB only"""
+	if frappe.db.db_type != "mariadb" or frappe.db.has_index("tabKCB Payment Transaction", FULLTEXT_INDEX):
+		return
+
+	frappe.db.sql_ddl(
+		f"alter table `tabKCB Payment Transaction` add fulltext index `{FULLTEXT_INDEX}` (search_name)"
+	)
@@ -6,6 +6,12 @@ from contextlib import contextmanager
 import frappe
 from frappe import _
 
+from .diagnostics import record
+from .metrics import instrument, set_till
+from .settings_cache import get_mpesa_settings
+from .stk_cache import cache_stk_receipt
+from .stk_post_processing import enqueue_post_processing
+
 
 def log_and_throw_error(err_msg, context=None):
 	frappe.log_error(frappe.get_traceback(), err_msg)
@@ -14,6 +20,15 @@ def log_and_throw_error(err_msg, context=None):
 
 
 def sanitize_mobile_number(number: str) -> str:
+	sanitized = normalize_mobile_number(number)
+	if not sanitized:
+		frappe.throw("Please enter a valid Kenyan mobile number (e.g. 0712345678 or +254712345678).")
+
+	return sanitized
+
+
+def normalize_mobile_number(number: str) -> str | None:
+	"""`number` in 2547XXXXXXXX/2541XXXXXXXX form, None when it is not a Kenyan mobile number"""
 	number = str(number).strip().replace(" ", "").replace("-", "")
 
 	# Normalize country code
@@ -26,7 +41,7 @@ def sanitize_mobile_number(number: str) -> str:
 
 	# Validate length and numeric content
 	if not re.fullmatch(r"[17]\d{8}", number):
-		frappe.throw("Please enter a valid Kenyan mobile number (e.g. 0712345678 or +254712345678).")
+		return None
 
 	return "254" + number
 
@@ -107,19 +122,20 @@ def handle_pos_payment_success(request_doc, metadata_dict, checkout_request_id):
 
 
 @frappe.whitelist(allow_guest=True, methods=["POST"])
+@instrument("stk_callback", get_outcome=lambda response: response.get("status"))
 def stk_push_callback():
 	frappe.set_user("Administrator")
 	try:
 		# Read and parse request body
 		data = frappe.request.data
 		if not data:
-			frappe.log_error("KCB STK Callback Error", "Empty request body received")
+			record("stk_callback:empty_body", "KCB STK Callback Error", "Empty request body received")
 			return {"status": "failed", "reason": "Empty request body"}
 
 		try:
 			payload = json.loads(data)
 		except ValueError:
-			frappe.log_error("KCB STK Callback Error", f"Invalid JSON: {data}")
+			record("stk_callback:invalid_json", "KCB STK Callback Error", f"Invalid JSON: {data}")
 			return {"status": "failed", "reason": "Invalid JSON payload"}
 
 		# Extract the core callback object
@@ -128,7 +144,9 @@ def stk_push_callback():
 		# frappe.log_error(title="STK Callback", message=f"{stk_callback!s}")
 
 		if not stk_callback:
-			frappe.log_error("KCB STK Callback Error", f"Missing stkCallback: {payload}")
+			record(
+				"stk_callback:missing_callback", "KCB STK Callback Error", f"Missing stkCallback: {payload}"
+			)
 			return {"status": "failed", "reason": "Missing stkCallback in payload"}
 
 		merchant_request_id = stk_callback.get("MerchantRequestID")
@@ -142,29 +160,19 @@ def stk_push_callback():
 
 		result_desc = stk_callback.get("ResultDesc")
 
-		stk_request = None
-		if merchant_request_id:
-			stk_request = frappe.db.get_value(
-				"KCB Mpesa STK Request",
-				{"merchant_request_id": merchant_request_id},
-				"name",
-			)
-		if not stk_request and checkout_request_id:
-			stk_request = frappe.db.get_value(
-				"KCB Mpesa STK Request",
-				{"checkout_request_id": checkout_request_id},
-				"name",
-			)
+		stk_request = find_stk_request(merchant_request_id, checkout_request_id)
 
 		if not stk_request:
-			frappe.log_error(
+			record(
+				"stk_callback:unknown_request",
 				"KCB STK Callback Error",
 				f"No STK Request found for MerchantRequestID={merchant_request_id} or CheckoutRequestID={checkout_request_id}",
 			)
 			return {"status": "failed", "reason": "STK Request not found"}
 
 		doc = frappe.get_doc("KCB Mpesa STK Request", stk_request)
-		settings = frappe.get_doc("KCB Mpesa Settings", doc.kcb_mpesa_settings)
+		settings = get_mpesa_settings(doc.kcb_mpesa_settings)
+		set_till(settings.till_no)
 
 		# Update the document with callback info
 		doc.result_code = result_code
@@ -176,20 +184,25 @@ def stk_push_callback():
 			metadata = stk_callback.get("CallbackMetadata", {}).get("Item", [])
 			metadata_dict = {item.get("Name"): item.get("Value") for item in metadata if "Name" in item}
 
-			handle_successful_transaction(doc, metadata_dict, settings, checkout_request_id)
-
 			doc.transaction_amount = metadata_dict.get("Amount")
 			doc.mpesa_receipt_number = metadata_dict.get("MpesaReceiptNumber")
 			doc.transaction_date = metadata_dict.get("TransactionDate")
 			doc.callback_phone_number = metadata_dict.get("PhoneNumber")
 			doc.status = status
+			# invoices and payment entries are created by a background job, see stk_post_processing
+			doc.post_processing_status = "Pending"
 		else:
 			# Error / Failed transaction
 			doc.status = "Failed"
 
 		doc.save(ignore_permissions=True)
+		if doc.post_processing_status == "Pending":
+			enqueue_post_processing(doc.name)
 		frappe.db.commit()
 
+		if doc.status == "Completed":
+			cache_stk_receipt(doc.mpesa_receipt_number, doc.reference_name)
+
 		frappe.logger().info(
 			{
 				"event": "KCB STK Callback Processed",
@@ -203,10 +216,32 @@ def stk_push_callback():
 		return {"status": "success", "message": "Callback processed"}
 
 	except Exception as e:
-		frappe.log_error("KCB STK Callback Exception", f"Error: {e!s}")
+		record(f"stk_callback:error:{type(e).__name__}", "KCB STK Callback Exception", f"Error: {e!s}")
 		return {"status": "failed", "reason": str(e)}
 
 
+def find_stk_request(merchant_request_id: str | None, checkout_request_id: str | None) -> str | None:
+	"""Name of the STK request a callback belongs to.
+
+	Looked up by MerchantRequestID, and by CheckoutRequestID only when that
+	finds nothing. Each is a single indexed lookup.
+	"""
+	stk_request = frappe.qb.DocType("KCB Mpesa STK Request")
+
+	for field, value in (
+		(stk_request.merchant_request_id, merchant_request_id),
+		(stk_request.checkout_request_id, checkout_request_id),
+	):
+		if not value:
+			continue
+
+		match = frappe.qb.from_(stk_request).select(stk_request.name).where(field == value).limit(1).run()
+		if match:
+			return match[0][0]
+
+	return None
+
+
 def get_stk_push_callback(sandbox: bool = False) -> str:
 	if sandbox:
 		return "https://posthere.io/f613-4b7f-b82b"
@@ -0,0 +1,40 @@
+import frappe
+
+
+def execute():
+	"""Make kcb_transaction_id unique before the unique index is added.
+
+	Concurrent redeliveries could previously slip past the exists() check. The
+	earliest row keeps the KCB transaction id, later copies get a suffix so they
+	remain traceable.
+	"""
+	if not frappe.db.table_exists("KCB Payment Transaction"):
+		return
+
+	duplicates = frappe.db.sql(
+		"""
+		select kcb_transaction_id
+		from `tabKCB Payment Transaction`
+		where ifnull(kcb_transaction_id, '') != ''
+		group by kcb_transaction_id
+		having count(*) > 1
+		""",
+		pluck=True,
+	)
+
+	for kcb_transaction_id in duplicates:
+		names = frappe.get_all(
+			"KCB Payment Transaction",
+			filters={"kcb_transaction_id": kcb_transaction_id},
+			order_by="creation asc",
+			pluck="name",
+		)
+
+		for name in names[1:]:
+			frappe.db.set_value(
+				"KCB Payment Transaction",
+				name,
+				"kcb_transaction_id",
+				f"{kcb_transaction_id}-DUP-{name}",
+				update_modified=False,
+			)
@@ -0,0 +1,27 @@
+import frappe
+
+BATCH_SIZE = 5000
+
+
+def execute():
+	"""Fill amount_cents and remaining_cents of existing KCB Payment Transactions, in batches by name"""
+	after = ""
+	while names := frappe.get_all(
+		"KCB Payment Transaction",
+		filters={"name": [">", after]},
+		order_by="name asc",
+		limit=BATCH_SIZE,
+		pluck="name",
+	):
+		frappe.db.sql(
+			"""
+			update `tabKCB Payment Transaction`
+			set amount_cents = round(amount * 100),
+				remaining_cents = greatest(round(amount * 100) - round(reconciled * 100), 0)
+			where name in %(names)s
+			""",
+			{"names": names},
+		)
+		frappe.db.commit()
+
+		after = names[-1]
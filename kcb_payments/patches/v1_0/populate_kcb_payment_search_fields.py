@@ -0,0 +1,37 @@
+import frappe
+
+from kcb_payments.kcb_payments.utils.transaction_search import get_search_values
+
+BATCH_SIZE = 5000
+
+
+def execute():
+	"""Fill the normalised search columns of existing KCB Payment Transactions, in batches by name"""
+	after = ""
+	while True:
+		transactions = frappe.get_all(
+			"KCB Payment Transaction",
+			filters={"name": [">", after]},
+			fields=[
+				"name",
+				"mobile_number",
+				"first_name",
+				"middle_name",
+				"last_name",
+				"originator_conversation_id",
+			],
+			order_by="name asc",
+			limit=BATCH_SIZE,
+		)
+		if not transactions:
+			break
+
+		frappe.db.bulk_update(
+			"KCB Payment Transaction",
+			{transaction.name: get_search_values(transaction) for transaction in transactions},
+			chunk_size=500,
+			update_modified=False,
+		)
+		frappe.db.commit()
+
+		after = transactions[-1].name
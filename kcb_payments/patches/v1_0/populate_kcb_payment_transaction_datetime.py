@@ -0,0 +1,31 @@
+import frappe
+
+from kcb_payments.kcb_payments.utils.ipn import parse_transaction_datetime
+
+BATCH_SIZE = 5000
+
+
+def execute():
+	"""Parse transaction_datetime for existing KCB Payment Transactions, in batches by name"""
+	after = ""
+	while True:
+		transactions = frappe.get_all(
+			"KCB Payment Transaction",
+			filters={"name": [">", after], "transaction_datetime": ["is", "not set"]},
+			fields=["name", "transaction_date", "timestamp"],
+			order_by="name asc",
+			limit=BATCH_SIZE,
+		)
+		if not transactions:
+			break
+
+		updates = {}
+		for transaction in transactions:
+			if transaction_datetime := parse_transaction_datetime(transaction):
+				updates[transaction.name] = {"transaction_datetime": transaction_datetime}
+
+		if updates:
+			frappe.db.bulk_update("KCB Payment Transaction", updates, chunk_size=500, update_modified=False)
+			frappe.db.commit()
+
+		after = transactions[-1].name
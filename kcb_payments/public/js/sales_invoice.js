@@ -75,7 +75,23 @@ const show_dialog = (frm) => {
 	d.show();
 };
 
+const KCB_SEARCH_PAGE_LENGTH = 50;
+
 const searchKCBPayments = (searchCriteria, frm) => {
+	fetch_kcb_payment_transactions(searchCriteria, null, (transactions) => {
+		if (transactions.length > 0) {
+			display_kcb_payment_transactions_results(transactions, searchCriteria, frm);
+		} else {
+			frappe.msgprint({
+				title: __("No Results"),
+				message: __("No matching payments found for the given criteria."),
+				indicator: "orange",
+			});
+		}
+	});
+};
+
+const fetch_kcb_payment_transactions = (searchCriteria, cursor, callback) => {
 	frappe.call({
 		method: "kcb_payments.kcb_payments.utils.kcb_payment_notification.fetch_kcb_payment_transactions",
 		args: {
@@ -83,22 +99,16 @@ const searchKCBPayments = (searchCriteria, frm) => {
 			name: searchCriteria.customer_name,
 			amount: searchCriteria.amount,
 			originator_conversation_id: searchCriteria.mpesa_transaction_id,
+			cursor: cursor,
+			page_length: KCB_SEARCH_PAGE_LENGTH,
 		},
 		callback: function (response) {
-			if (response.message && response.message.length > 0) {
-				display_kcb_payment_transactions_results(response.message, frm);
-			} else {
-				frappe.msgprint({
-					title: __("No Results"),
-					message: __("No matching payments found for the given criteria."),
-					indicator: "orange",
-				});
-			}
+			callback(response.message || []);
 		},
 	});
 };
 
-const display_kcb_payment_transactions_results = (transactions, frm) => {
+const display_kcb_payment_transactions_results = (transactions, searchCriteria, frm) => {
 	let results_dialog = new frappe.ui.Dialog({
 		title: __("KCB Payment Transactions"),
 		size: "large",
@@ -113,8 +123,21 @@ const display_kcb_payment_transactions_results = (transactions, frm) => {
 		primary_action: function () {
 			results_dialog.hide();
 		},
+		secondary_action_label: __("Load More"),
+		secondary_action: function () {
+			let cursor = transactions[transactions.length - 1].cursor;
+			fetch_kcb_payment_transactions(searchCriteria, cursor, (page) => {
+				transactions = transactions.concat(page);
+				results_dialog.fields_dict.results_html.$wrapper.html(
+					create_kcb_transactions_HTML(transactions)
+				);
+				results_dialog.get_secondary_btn().toggle(page.length === KCB_SEARCH_PAGE_LENGTH);
+			});
+		},
 	});
 
+	// a full page means there may be more
+	results_dialog.get_secondary_btn().toggle(transactions.length === KCB_SEARCH_PAGE_LENGTH);
 	results_dialog.show();
 
 	$(results_dialog.wrapper).on("click", ".select-transaction", function () {